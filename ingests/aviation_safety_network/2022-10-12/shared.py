@@ -1,9 +1,8 @@
-import tempfile
 from pathlib import Path
 
 import pandas as pd
 
-from owid.walden import Dataset, add_to_catalog, files
+from owid.walden import Dataset, add_to_catalog
 
 CURRENT_DIR = Path(__file__).parent
 
@@ -25,11 +24,5 @@ def add_dataframe_with_metadata_to_catalog(df: pd.DataFrame, metadata: Dataset,
         True to upload data to Walden bucket.
 
     """
-    # Store dataframe in a temporary file.
-    with tempfile.NamedTemporaryFile() as _temp_file:
-        # Save data in a temporary file.
-        df.to_csv(_temp_file.name, index=False)
-        # Add file checksum to metadata.
-        metadata.md5 = files.checksum(_temp_file.name)
-        # Create walden index file and upload to s3 (if upload is True).
-        add_to_catalog(metadata, _temp_file.name, upload=upload)
+    # Save data as a csv file in the cache, create walden index file and upload to s3 (if upload is True).
+    add_to_catalog(metadata, dataframe=df, upload=upload, canonical=True)
@@ -58,7 +58,7 @@ def main(upload: bool) -> None:
     dataset = Dataset.from_yaml(METADATA_PATH)
 
     # Add data to Walden catalog and metadata to Walden index.
-    add_to_catalog(metadata=dataset, dataframe=df, upload=upload)
+    add_to_catalog(metadata=dataset, dataframe=df, upload=upload, canonical=True)
 
     # Update Walden datasets.
     dataset.save()
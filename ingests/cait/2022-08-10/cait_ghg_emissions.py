@@ -16,7 +16,6 @@ See https://www.climatewatchdata.org/data-explorer/historical-emissions
 
 import argparse
 import gzip
-import json
 import os
 import tempfile
 from pathlib import Path
@@ -25,7 +24,7 @@ from time import sleep
 import requests
 from tqdm.auto import tqdm
 
-from owid.walden import Dataset, add_to_catalog
+from owid.walden import Dataset, add_to_catalog, files
 
 ########################################################################################################################
 
@@ -77,7 +76,7 @@ def fetch_all_data_from_api(
     data_all = []
     for page in tqdm(range(1, total_requests + 1)):
         response = session.get(url=api_url, json={"page": page, "per_page": api_records_per_request})
-        new_data = json.loads(response.content)["data"]
+        new_data = files.json_loads(response.content)["data"]
         if len(new_data) == 0:
             print("No more data to fetch.")
             break
@@ -99,7 +98,7 @@ def save_compressed_data_to_file(data, data_file):
 
     """
     with gzip.open(data_file, "wt", encoding="UTF-8") as _output_file:
-        json.dump(data, _output_file)
+        _output_file.write(files.json_dumps(data))
 
 
 def main():
@@ -27,7 +27,6 @@ poetry run python -m ingests.faostat
 
 import argparse
 import datetime as dt
-import json
 import tempfile
 from pathlib import Path
 from typing import cast
@@ -264,17 +263,17 @@ class FAOAdditionalMetadata:
             # Get list of categories (e.g. "items", "element", etc.) for this dataset.
             response = requests.get(f"{API_BASE_URL}/{domain}")
             assert response.ok, f"Failed to fetch API data for dataset {domain}."
-            categories = [field["code"] for field in json.loads(response.content)["data"]]
+            categories = [field["code"] for field in files.json_loads(response.content)["data"]]
             for category in categories:
                 resp = requests.get(f"{API_BASE_URL}/{domain}/{category}")
                 if resp.ok:
-                    domain_meta[category] = resp.json()
+                    domain_meta[category] = files.json_loads(resp.content)
 
             metadata_combined[domain] = domain_meta
 
         # Save additional metadata to temporary local file.
         with open(output_filename, "w") as _output_filename:
-            json.dump(metadata_combined, _output_filename, indent=2, sort_keys=True)
+            _output_filename.write(files.json_dumps(metadata_combined, indent=2, sort_keys=True))
 
         return metadata_combined
 
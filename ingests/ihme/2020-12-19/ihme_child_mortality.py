@@ -8,7 +8,6 @@ from typing import List
 import click
 import pandas as pd
 import requests
-from owid.repack import repack_frame
 from structlog import get_logger
 
 from owid.walden import add_to_catalog
@@ -43,12 +42,9 @@ def main(upload: bool) -> None:
             df_all.append(df_num)
             df_all.append(df_prob)
         dataset = pd.concat(df_all)
-        # consolidate data
-        dataset = repack_frame(dataset)
-        data_file = os.path.join(temp_dir, f"data.{metadata.file_extension}")
+        # consolidate data, packing it into compact dtypes
         dataset = dataset.reset_index()
-        dataset.to_feather(data_file)
-        add_to_catalog(metadata, data_file, upload=upload)
+        add_to_catalog(metadata, dataframe=dataset, upload=upload, pack=True)
 
 
 def get_location_hierachies():
@@ -72,7 +72,6 @@ import os
 
 import click
 import pandas as pd
-from owid.repack import repack_frame
 from structlog import get_logger
 
 from owid.walden import add_to_catalog
@@ -94,7 +93,7 @@ def main(path: str, upload: bool) -> None:
     descriptions = ["Deaths and DALYs", "Risk factors", "Prevalence and incidence", "Child mortality", "Mental health"]
     for name, description in zip(names, descriptions):
         log.info("Combining data for:", df_name=name)
-        outpath = combine_csvs(name=name, inpath=f"{path}{name}/csv/")
+        df = combine_csvs(inpath=f"{path}{name}/csv/")
         metadata = {
             "namespace": "ihme_gbd",
             "short_name": name,
@@ -108,20 +107,17 @@ def main(path: str, upload: bool) -> None:
             "license_url": "https://www.healthdata.org/data-tools-practices/data-practices/terms-and-conditions",
         }
         log.info("Adding data to catalog:", df_name=name)
-        add_to_catalog(metadata=metadata, filename=outpath, upload=upload, public=False)
+        add_to_catalog(metadata=metadata, dataframe=df, upload=upload, public=False, pack=True)
 
 
-def combine_csvs(name: str, inpath: str) -> str:
+def combine_csvs(inpath: str) -> pd.DataFrame:
     # setting the path for joining multiple files
     files = os.path.join(inpath, "*.csv")
     # list of merged files returned
     files = glob.glob(files)
     # joining files with concat and read_csv
     df = pd.concat(map(pd.read_csv, files), ignore_index=True)
-    outpath = f"{inpath}{name}.feather"
-    df = repack_frame(df)
-    df.to_feather(outpath)
-    return outpath
+    return df
 
 
 if __name__ == "__main__":
@@ -5,7 +5,6 @@
 import json
 import re
 import sys
-import tempfile
 from pathlib import Path
 from time import sleep
 from typing import List
@@ -18,7 +17,7 @@ from bs4 import BeautifulSoup
 from owid.datautils import dataframes
 from tqdm.auto import tqdm
 
-from owid.walden import Dataset, add_to_catalog, files
+from owid.walden import Dataset, add_to_catalog
 
 # Time (in seconds) to wait between consecutive queries.
 TIME_BETWEEN_QUERIES = 1
@@ -439,13 +438,8 @@ def main(upload: bool) -> None:
     # Load metadata from the corresponding yaml file.
     metadata = Dataset.from_yaml(METADATA_FILE)
 
-    with tempfile.NamedTemporaryFile() as _temp_file:
-        # Save data in a temporary feather file.
-        energy_data.to_csv(_temp_file.name)
-        # Add file checksum to metadata.
-        metadata.md5 = files.checksum(_temp_file.name)
-        # Create walden index file and upload to s3 (if upload is True).
-        add_to_catalog(metadata, _temp_file.name, upload=upload)
+    # Save data as a csv file in the cache, create walden index file and upload to s3 (if upload is True).
+    add_to_catalog(metadata, dataframe=energy_data, upload=upload, canonical=True, skip_unchanged=True)
 
 
 if __name__ == "__main__":
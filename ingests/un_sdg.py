@@ -1,3 +1,4 @@
+import dataclasses
 import datetime as dt
 import json
 import os
@@ -24,6 +25,11 @@ URL_METADATA = "https://unstats.un.org/sdgs/indicators/SDG_Updateinfo.xlsx"
 MAX_RETRIES = 10
 CHUNK_SIZE = 1024 * 1024 * 10
 
+# fields describing the stored data file, which the unit and dimension datasets must not inherit
+RESET_FIELDS: Dict[str, Any] = dict(
+    md5=None, fingerprint=None, owid_data_url=None, owid_profile_url=None, transport_compression=None
+)
+
 
 def main():
     log.info("Creating metadata...")
@@ -33,18 +39,24 @@ def main():
         assert metadata.source_data_url is not None
         log.info("Downloading data...")
         all_data = download_data()
-        log.info("Saving data...")
-        data_file = os.path.join(temp_dir, f"data.{metadata.file_extension}")
-        all_data.to_feather(data_file)
         log.info("Adding data to catalog...")
-        add_to_catalog(metadata, data_file, upload=True)  # type: ignore
+        dataset = add_to_catalog(
+            metadata, dataframe=all_data, upload=True, canonical=True, skip_unchanged=True, pack=True  # type: ignore
+        )
+        if dataset is None:
+            # the unit and dimension descriptions only make sense next to a new version of the data
+            log.info("Data unchanged, skipping unit and dimension descriptions")
+            return
 
         log.info("Downloading unit descriptions...")
         unit_desc = attributes_description()
-        metadata_unit = metadata
-        metadata_unit.description = "A description of the units the data is measured in."
-        metadata_unit.short_name = "unit"
-        metadata_unit.file_extension = "json"
+        metadata_unit = dataclasses.replace(
+            metadata,
+            description="A description of the units the data is measured in.",
+            short_name="unit",
+            file_extension="json",
+            **RESET_FIELDS,
+        )
         log.info("Saving unit descriptions...")
         unit_file = os.path.join(temp_dir, f"data.{metadata_unit.file_extension}")
         with open(unit_file, "w") as fp:
@@ -55,10 +67,13 @@ def main():
 
         log.info("Downloading dimension descriptions...")
         dim_desc = dimensions_description()
-        metadata_dim = metadata
-        metadata_dim.description = "A description of the dimensions of the data."
-        metadata_dim.short_name = "dimension"
-        metadata_dim.file_extension = "json"
+        metadata_dim = dataclasses.replace(
+            metadata,
+            description="A description of the dimensions of the data.",
+            short_name="dimension",
+            file_extension="json",
+            **RESET_FIELDS,
+        )
         log.info("Saving dimension descriptions...")
         dim_file = os.path.join(temp_dir, f"data.{metadata_dim.file_extension}")
         with open(dim_file, "w") as fp:
@@ -125,9 +140,6 @@ def download_data() -> pd.DataFrame:
         all_data.append(df)
     all_df = pd.concat(all_data)
     all_df = all_df.reset_index()
-    cols = all_df.columns
-    # Converting all columns to string dtype as feather doesn't like object dtype
-    all_df[cols] = all_df[cols].astype("str")
 
     return all_df
 
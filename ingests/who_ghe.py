@@ -1,6 +1,4 @@
 import json
-import os
-import tempfile
 from pathlib import Path
 from typing import List
 
@@ -23,17 +21,14 @@ log = get_logger()
     help="Upload dataset to Walden",
 )
 def main(upload: bool):
-    with tempfile.TemporaryDirectory() as temp_dir:
-        log.info("Creating metadata...")
-        metadata = Dataset.from_yaml(Path(__file__).parent / "who_ghe.meta.yml")
-        # Get the list of causes of disease/injury. The data is too big to request all at once.
-        causes = get_causes_list()
-        # Download the data
-        dataset = download_cause_data(causes)
-        data_file = os.path.join(temp_dir, f"data.{metadata.file_extension}")
-        # Save it locally as a temp feather file.
-        dataset.to_feather(data_file)
-        add_to_catalog(metadata, data_file, upload=upload)
+    log.info("Creating metadata...")
+    metadata = Dataset.from_yaml(Path(__file__).parent / "who_ghe.meta.yml")
+    # Get the list of causes of disease/injury. The data is too big to request all at once.
+    causes = get_causes_list()
+    # Download the data
+    dataset = download_cause_data(causes)
+    # Save it as a compact feather file, deterministically so that unchanged data is not uploaded again.
+    add_to_catalog(metadata, dataframe=dataset, upload=upload, canonical=True, skip_unchanged=True, pack=True)
 
 
 def get_causes_list() -> List[str]:
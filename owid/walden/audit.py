@@ -5,61 +5,153 @@
 #  walden
 #
 
+import asyncio
 import concurrent.futures
+import hashlib
+import json
+import os
+import time
 import warnings
+from collections import defaultdict
+from os import path
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
 
 import click
 import jsonschema
 import requests
 
-from owid.walden import catalog
+from owid.walden import catalog, files, manifest, owid_cache, ui
+
+# status codes that we accept for a URL that is still valid
+OK_STATUS_CODES = (200, 301, 302)
+
+# seconds to wait for a server to answer before giving up on a URL
+URL_TIMEOUT = float(os.environ.get("WALDEN_URL_TIMEOUT", 10))
+
+# requests in flight to the same host at once, to be polite to upstream servers
+MAX_REQUESTS_PER_HOST = int(os.environ.get("WALDEN_MAX_REQUESTS_PER_HOST", 4))
+
+# requests in flight overall, no more than the connections pooled by `files._session()`
+MAX_REQUESTS = files.MAX_POOL_CONNECTIONS
+
+# how long to trust the result of a previous check, in seconds; failures are retried sooner
+URL_CACHE_TTL = float(os.environ.get("WALDEN_URL_CACHE_TTL_HOURS", 24)) * 3600
+URL_CACHE_NEGATIVE_TTL = 3600
+
+# results of previous checks, see `check_urls`
+URL_CACHE_FILE = path.join(catalog.CACHE_DIR, "url_audit.json")
+
+# digests of the documents that passed validation, see `validate_docs`
+VALIDATION_CACHE_FILE = path.join(catalog.CACHE_DIR, "index_audit.json")
 
 
 @click.command()
-def audit() -> None:
+@click.option("--no-cache", is_flag=True, help="Check every URL again, ignoring results of previous runs")
+@click.option("--full", is_flag=True, help="Validate every document, not only those changed since the last run")
+@click.option("--bucket", is_flag=True, help="Also check that every object in the bucket matches its index entry")
+def audit(no_cache: bool = False, full: bool = False, bucket: bool = False) -> None:
     "Audit files in the index against the schema."
     schema = catalog.load_schema()
 
     # exclude backported datasets
     docs = [(f, doc) for f, doc in catalog.iter_docs() if "walden/index/backport" not in f]
 
-    # speed it up with parallelization
-    with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-        results = executor.map(
-            lambda args: audit_doc(args[0], args[1], schema),
-            docs,
-        )
+    validate_docs(docs, schema, incremental=not full)
+
+    to_check: List[Tuple[str, bool]] = []
+    for filename, doc in docs:
+        to_check.extend(audit_doc(filename, doc))
+
+    statuses = check_urls([url for url, _ in to_check], use_cache=not no_cache)
+
+    invalid = []
+    for url, strict in to_check:
+        if statuses[url] not in OK_STATUS_CODES:
+            if strict:
+                invalid.append(url)
+            else:
+                warnings.warn(f"Invalid or expired URL: {url}")
+
+    if invalid:
+        raise InvalidOrExpiredUrl(", ".join(invalid))
+
+    if bucket:
+        files_in_bucket = manifest.load(owid_cache.connect())
+        sizes = {key: entry["size"] for key, entry in files_in_bucket.items() if entry.get("size") is not None}
+        problems = check_objects([doc for _, doc in docs], sizes=sizes)
+        for problem in problems:
+            ui.log("PROBLEM", problem)
+        if problems:
+            raise CorruptOrMissingObject(f"{len(problems)} objects in the bucket do not match the index")
+
+    print(f"{len(docs)} catalog entries ok, all urls ok" + (", all objects ok" if bucket else ""))
+
+
+def validate_docs(
+    docs: List[Tuple[str, dict]],
+    schema: dict,
+    incremental: bool = True,
+    cache_file: str = VALIDATION_CACHE_FILE,
+) -> int:
+    """
+    Validate the documents against the schema, returning how many were validated. With
+    `incremental`, documents whose digest already passed validation against the same schema
+    are skipped, so that the cost scales with the change and not with the catalog.
+    """
+    validator = compile_schema(schema)
+    schema_digest = _digest(schema)
 
-    print(f"{len(list(results))} catalog entries ok, all urls ok")
+    state = _load_json(cache_file) if incremental else {}
+    passed: Dict[str, str] = state.get("docs", {}) if state.get("schema") == schema_digest else {}
 
+    n_validated = 0
+    try:
+        for filename, doc in docs:
+            relative_path = str(Path(filename).relative_to(catalog.INDEX_DIR))
+            digest = _digest(doc)
+            if passed.get(relative_path) == digest:
+                continue
+
+            print(relative_path)
+            error = jsonschema.exceptions.best_match(validator.iter_errors(doc))
+            if error is not None:
+                raise error
+
+            passed[relative_path] = digest
+            n_validated += 1
+    finally:
+        # remember what passed so far even if a document failed
+        _save_json({"schema": schema_digest, "docs": passed}, cache_file)
+
+    return n_validated
 
-def audit_doc(filename: str, document: dict, schema: dict) -> None:
-    print(Path(filename).relative_to(catalog.INDEX_DIR))
-    jsonschema.validate(document, schema)
 
+def compile_schema(schema: dict) -> Any:
+    "Build a validator for the schema once, to reuse it for every document."
+    cls = jsonschema.validators.validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+def audit_doc(filename: str, document: dict) -> List[Tuple[str, bool]]:
+    """
+    Return the URLs in the (already validated) document that should be checked, each with
+    whether it must be valid (strict) or only deserves a warning.
+    """
     if "owid_data_url" not in document:
         raise Exception(f"Missing 'owid_data_url' in {filename}")
 
     if "source_data_url" in document and document.get("is_public", True):
-        check_url(document["owid_data_url"])
-        check_url(document["source_data_url"], strict=False)
+        return [(document["owid_data_url"], True), (document["source_data_url"], False)]
+
+    return []
 
 
 def check_url(url: str, strict: bool = True) -> None:
     "Make sure the URL is still valid."
-    status_code: Optional[int]
-
-    try:
-        resp = requests.head(url)
-        status_code = resp.status_code
-    except requests.exceptions.SSLError:
-        status_code = None
-    except requests.exceptions.ConnectionError:
-        status_code = None
-
-    if status_code not in (200, 301, 302):
+    if check_urls([url])[url] not in OK_STATUS_CODES:
         if strict:
             raise InvalidOrExpiredUrl(url)
         else:
@@ -67,9 +159,131 @@ def check_url(url: str, strict: bool = True) -> None:
             return
 
 
+def check_urls(
+    urls: Iterable[str], use_cache: bool = True, cache_file: str = URL_CACHE_FILE
+) -> Dict[str, Optional[int]]:
+    """
+    Return the HTTP status code of each URL, or None if its server could not be reached
+    in time. Results of earlier runs, including failures, are reused until they expire.
+    """
+    urls = list(dict.fromkeys(urls))
+    cache = _load_json(cache_file) if use_cache else {}
+
+    now = time.time()
+    stale = [url for url in urls if not _is_fresh(cache.get(url), now)]
+    if stale:
+        for url, status_code in asyncio.run(_check_urls_async(stale)).items():
+            cache[url] = {"status_code": status_code, "checked": now}
+        _save_json(cache, cache_file)
+
+    return {url: cache[url]["status_code"] for url in urls}
+
+
+async def _check_urls_async(urls: List[str]) -> Dict[str, Optional[int]]:
+    """
+    Check the URLs concurrently with at most `MAX_REQUESTS_PER_HOST` requests to any one
+    host, so that many datasets from the same source do not hammer its server. Requests go
+    through the pooled session of `files`, run on a thread pool, and each gives up after
+    `URL_TIMEOUT` by itself, so that a host is only free again once its requests are over.
+    """
+    loop = asyncio.get_running_loop()
+    per_host: Dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(MAX_REQUESTS_PER_HOST))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_REQUESTS) as executor:
+
+        async def check(url: str) -> Tuple[str, Optional[int]]:
+            async with per_host[urlparse(url).netloc]:
+                status_code = await loop.run_in_executor(executor, _head, url, URL_TIMEOUT)
+
+            return url, status_code
+
+        results = await asyncio.gather(*[check(url) for url in urls])
+
+    return dict(results)
+
+
+def check_objects(docs: List[dict], sizes: Optional[Dict[str, int]] = None) -> List[str]:
+    """
+    Compare the object behind the `owid_data_url` of every document, public or private,
+    with its index entry using only HEAD requests, and describe every missing object or
+    mismatched md5. With `sizes` from the manifest, a changed size is reported too. Requests
+    run concurrently through the shared bucket client.
+    """
+    to_check = []
+    for doc in docs:
+        if not doc.get("owid_data_url"):
+            continue
+
+        bucket, key = owid_cache.s3_bucket_key(doc["owid_data_url"])
+        if bucket == "walden":
+            to_check.append((doc, key))
+
+    # no more threads than the connections pooled by the bucket client, see `owid_cache.connect()`
+    with concurrent.futures.ThreadPoolExecutor(max_workers=owid_cache.MAX_CONCURRENCY) as executor:
+        heads = list(executor.map(lambda args: owid_cache.head_object("walden", args[1]), to_check))
+
+    problems = []
+    for (doc, key), head in zip(to_check, heads):
+        if head is None:
+            problems.append(f"missing: {key}")
+            continue
+
+        size = head.get("ContentLength")
+        if sizes and key in sizes and size != sizes[key]:
+            problems.append(f"size mismatch: {key} (manifest {sizes[key]}, bucket {size})")
+
+        # for compressed objects the ETag is that of the compressed bytes, so only our metadata tells
+        md5 = head.get("Metadata", {}).get("md5")
+        if md5 is None and not doc.get("transport_compression"):
+            md5 = owid_cache.md5_from_head(head)
+
+        if md5 and doc.get("md5") and md5 != doc["md5"]:
+            problems.append(f"md5 mismatch: {key} (index {doc['md5']}, bucket {md5})")
+
+    return problems
+
+
+def _head(url: str, timeout: float) -> Optional[int]:
+    try:
+        return files._session().head(url, timeout=timeout).status_code
+    except requests.exceptions.RequestException:
+        return None
+
+
+def _is_fresh(entry: Optional[dict], now: float) -> bool:
+    if entry is None:
+        return False
+
+    ttl = URL_CACHE_TTL if entry["status_code"] in OK_STATUS_CODES else URL_CACHE_NEGATIVE_TTL
+    return now - entry["checked"] < ttl
+
+
+def _digest(doc: Any) -> str:
+    return hashlib.md5(json.dumps(doc, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _load_json(cache_file: str) -> Dict[str, Any]:
+    try:
+        with open(cache_file) as istream:
+            return json.load(istream)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_json(cache: Dict[str, Any], cache_file: str) -> None:
+    os.makedirs(path.dirname(cache_file), exist_ok=True)
+    with open(cache_file + ".tmp", "w") as ostream:
+        json.dump(cache, ostream)
+    os.replace(cache_file + ".tmp", cache_file)
+
+
 class InvalidOrExpiredUrl(Exception):
     pass
 
 
+class CorruptOrMissingObject(Exception):
+    pass
+
+
 if __name__ == "__main__":
     audit()
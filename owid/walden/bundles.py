@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  bundles.py
+#  walden
+#
+#  The index as one NDJSON file per namespace instead of one JSON file per dataset, so that
+#  the catalog loads with a handful of sequential reads. Bundles are built from the index
+#  folder with `python owid/walden/bundles.py`, and `Dataset.save` keeps them up to date.
+#  The whole index is also published to our bucket as a single compressed bundle, so that
+#  `Catalog(remote=True)` works without this repository.
+#
+
+import gzip
+import logging
+import os
+import tempfile
+from os import path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import click
+import requests
+
+from owid.walden import files, owid_cache, ui
+
+BUNDLE_EXTENSION = ".ndjson"
+
+# the whole index as one gzipped bundle in our bucket, see `publish` and `fetch_remote`
+REMOTE_BUNDLE_KEY = "_catalog.ndjson.gz"
+REMOTE_BUNDLE_URL = f"{owid_cache.HTTPS_BASE}/{REMOTE_BUNDLE_KEY}"
+
+# seconds to wait for the bucket before falling back to our copy of the remote bundle
+REMOTE_TIMEOUT = 30
+
+
+def build(index_dir: str, bundle_dir: str, namespaces: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Write the bundle of every namespace in the index, or only of the given ones, and return
+    their paths. Bundles of namespaces that no longer exist are removed.
+    """
+    os.makedirs(bundle_dir, exist_ok=True)
+
+    existing = _namespaces(index_dir)
+    written = []
+    for namespace in sorted(namespaces) if namespaces is not None else existing:
+        filename = bundle_path(bundle_dir, namespace)
+        if namespace not in existing:
+            if path.exists(filename):
+                os.remove(filename)
+            continue
+
+        with open(filename + ".tmp", "w") as ostream:
+            ostream.write(render(index_dir, namespace))
+        os.replace(filename + ".tmp", filename)
+        written.append(filename)
+
+    if namespaces is None:
+        for namespace in set(_bundled_namespaces(bundle_dir)) - set(existing):
+            os.remove(bundle_path(bundle_dir, namespace))
+
+    return written
+
+
+def render(index_dir: str, namespace: str) -> str:
+    "The bundle of a namespace: one line per document, with its path relative to the index."
+    lines = []
+    for filename, doc in files.iter_docs(path.join(index_dir, namespace)):
+        lines.append(files.json_dumps({"path": path.relpath(filename, index_dir), "doc": doc}) + "\n")
+
+    return "".join(lines)
+
+
+def iter_docs(bundle_dir: str, index_dir: str) -> Iterator[Tuple[str, dict]]:
+    """
+    Iterate over the documents in the bundles, in the same order and with the same filenames
+    as iterating over the index folder they were built from.
+    """
+    for namespace in _bundled_namespaces(bundle_dir):
+        for relative_path, doc in files.iter_docs(bundle_path(bundle_dir, namespace)):
+            yield path.join(index_dir, relative_path), doc
+
+
+def check(index_dir: str, bundle_dir: str) -> List[str]:
+    "Return the namespaces whose bundle is missing, outdated or no longer needed."
+    existing = _namespaces(index_dir)
+    stale = sorted(set(_bundled_namespaces(bundle_dir)) - set(existing))
+    for namespace in existing:
+        filename = bundle_path(bundle_dir, namespace)
+        if not path.exists(filename) or _read(filename) != render(index_dir, namespace):
+            stale.append(namespace)
+
+    return stale
+
+
+def publish(index_dir: str) -> str:
+    """
+    Upload the whole index as a single gzipped bundle to our bucket and return its URL. The
+    same index always gives the same bytes, so an unchanged catalog is not uploaded again and
+    keeps its ETag.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = path.join(tmp_dir, REMOTE_BUNDLE_KEY)
+        with gzip.GzipFile(filename, "wb", mtime=0) as ostream:
+            for namespace in _namespaces(index_dir):
+                ostream.write(render(index_dir, namespace).encode("utf-8"))
+
+        return owid_cache.upload(filename, REMOTE_BUNDLE_KEY, public=True, md5=files.checksum(filename))
+
+
+def fetch_remote(cache_file: str, url: str = REMOTE_BUNDLE_URL) -> str:
+    """
+    Make sure that `cache_file` holds the latest remote bundle and return it. One conditional
+    request with the ETag of our copy tells whether it is still current, and our copy is used
+    if the bucket cannot be reached.
+    """
+    etag_file = cache_file + ".etag"
+    headers = {}
+    if path.exists(cache_file) and path.exists(etag_file):
+        headers["If-None-Match"] = _read(etag_file)
+
+    try:
+        with files._session().get(url, headers=headers, stream=True, timeout=REMOTE_TIMEOUT) as r:
+            if r.status_code == 304:
+                return cache_file
+
+            r.raise_for_status()
+            os.makedirs(path.dirname(cache_file), exist_ok=True)
+            with open(cache_file + ".tmp", "wb") as ostream:
+                for chunk in r.iter_content(chunk_size=2**16):
+                    ostream.write(chunk)
+            os.replace(cache_file + ".tmp", cache_file)
+
+            if r.headers.get("ETag"):
+                with open(etag_file, "w") as ostream:
+                    ostream.write(r.headers["ETag"])
+            elif path.exists(etag_file):
+                os.remove(etag_file)
+
+    except requests.exceptions.RequestException as e:
+        if not path.exists(cache_file):
+            raise
+        logging.warning(f"could not update the catalog from {url}, using our copy: {e}")
+
+    return cache_file
+
+
+def bundle_path(bundle_dir: str, namespace: str) -> str:
+    return path.join(bundle_dir, namespace + BUNDLE_EXTENSION)
+
+
+def _namespaces(index_dir: str) -> List[str]:
+    namespaces = [name for name in os.listdir(index_dir) if path.isdir(path.join(index_dir, name))]
+    return sorted(namespaces, key=lambda namespace: namespace + "/")
+
+
+def _bundled_namespaces(bundle_dir: str) -> List[str]:
+    if not path.isdir(bundle_dir):
+        return []
+
+    namespaces = [name[: -len(BUNDLE_EXTENSION)] for name in os.listdir(bundle_dir) if name.endswith(BUNDLE_EXTENSION)]
+
+    # sort like the paths of their documents, e.g. "a/..." before "a_b/..."
+    return sorted(namespaces, key=lambda namespace: namespace + "/")
+
+
+def _read(filename: str) -> str:
+    with open(filename) as istream:
+        return istream.read()
+
+
+@click.command()
+@click.option(
+    "--bundle-dir", help="Where to write the bundles, by default WALDEN_INDEX_BUNDLE_DIR or ~/.owid/walden/bundles"
+)
+@click.option("--check", "check_", is_flag=True, help="Only check that the bundles match the index, do not write them")
+@click.option(
+    "--publish",
+    "publish_",
+    is_flag=True,
+    help="Upload the whole index to the bucket as one bundle, see Catalog(remote=True)",
+)
+def main(bundle_dir: Optional[str] = None, check_: bool = False, publish_: bool = False) -> None:
+    "Build one NDJSON bundle per namespace from the JSON files of the index."
+    from owid.walden import catalog
+
+    if publish_:
+        ui.log("PUBLISHED", publish(catalog.INDEX_DIR))
+        return
+
+    bundle_dir = bundle_dir or catalog.BUNDLE_DIR or path.join(catalog.CACHE_DIR, "bundles")
+
+    if check_:
+        stale = check(catalog.INDEX_DIR, bundle_dir)
+        if stale:
+            ui.bail(f"bundles out of date for {', '.join(stale)}, please run python owid/walden/bundles.py")
+        return
+
+    for filename in build(catalog.INDEX_DIR, bundle_dir):
+        ui.log("BUNDLED", filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,19 +2,19 @@
 
 
 import datetime as dt
-import json
-import shutil
+import os
 from dataclasses import dataclass
 from os import makedirs, path
 from os import unlink as delete
 from pathlib import Path
-from typing import Any, Dict, Iterator, List, Literal, Optional, Tuple, Union
+from typing import Any, Dict, Iterable, Iterator, List, Literal, Optional, Tuple, Union
 
+import pandas as pd
 import yaml
 from dataclasses_json import dataclass_json
 from structlog import get_logger
 
-from . import files, owid_cache
+from . import bundles, files, frames, profiling, storage
 
 # our local copy
 CACHE_DIR = path.expanduser("~/.owid/walden")
@@ -28,8 +28,18 @@ INDEX_DIR = path.abspath(path.join(BASE_DIR, "index"))
 # the JSONschema that they must match
 SCHEMA_FILE = path.join(BASE_DIR, "schema.json")
 
+# the same documents as one NDJSON file per namespace, read instead of INDEX_DIR if set, see `bundles`
+BUNDLE_DIR = os.environ.get("WALDEN_INDEX_BUNDLE_DIR")
+
+# pinned datasets, see `Catalog.lock` and `Catalog.from_lock`
+LOCK_FILE = "walden.lock"
+
 log = get_logger()
 
+# URLs of the stored copies of every dataset in the catalog and of their profiles, by md5 and
+# transport compression, loaded once per process, see `_stored_urls`
+_stored_copies: Optional[Dict[Tuple[str, Optional[str]], List[Tuple[str, Optional[str]]]]] = None
+
 
 @dataclass_json
 @dataclass
@@ -90,6 +100,15 @@ class Dataset:
     owid_data_url: Optional[str] = None
     md5: Optional[str] = None
 
+    # hash of the dataframe contents for dataframe ingests, see `frames.fingerprint`
+    fingerprint: Optional[str] = None
+
+    # sidecar with columns, dtypes and coverage of tabular snapshots, see `load_profile()`
+    owid_profile_url: Optional[str] = None
+
+    # compression of the file at `owid_data_url`, e.g. "zstd"; `md5` is always that of the uncompressed file
+    transport_compression: Optional[str] = None
+
     def __post_init__(self) -> None:
         if self.version is None:
             if self.publication_date:
@@ -103,12 +122,22 @@ class Dataset:
             self.version = str(self.version)
 
     @classmethod
-    def download_and_create(cls, metadata: Union[dict, "Dataset"]) -> "Dataset":
+    def download_and_create(
+        cls, metadata: Union[dict, "Dataset"], upload: bool = False, public: bool = True
+    ) -> "Dataset":
+        """
+        Create a new dataset by downloading it from its `source_data_url`. Set `upload` to
+        stream it to our remote cache at the same time, see `download_and_upload`.
+        """
         if isinstance(metadata, dict):
             dataset = Dataset.from_dict(metadata)  # type: ignore
         else:
             dataset = metadata
 
+        if upload:
+            dataset.download_and_upload(public=public)
+            return dataset
+
         # make sure we have a local copy
         filename = dataset.ensure_downloaded()
 
@@ -118,20 +147,35 @@ class Dataset:
         return dataset
 
     @classmethod
-    def copy_and_create(cls, filename: str, metadata: Union[dict, "Dataset"]) -> "Dataset":
+    def copy_and_create(cls, filename: str, metadata: Union[dict, "Dataset"], move: bool = False) -> "Dataset":
         """
-        Create a new dataset if you already have the file locally.
+        Create a new dataset if you already have the file locally. Set `move` to move the
+        file into the cache instead of copying it.
         """
         if isinstance(metadata, dict):
             dataset = Dataset.from_dict(metadata)  # type: ignore
         else:
             dataset = metadata
 
-        # set the md5
-        dataset.md5 = files.checksum(filename)
+        # copy the file into the cache and set the md5, reading the file only once
+        dataset.md5 = dataset.add_to_cache(filename, move=move)
 
-        # copy the file into the cache
-        dataset.add_to_cache(filename)
+        return dataset
+
+    @classmethod
+    def write_and_create(cls, df: pd.DataFrame, metadata: Union[dict, "Dataset"], canonical: bool = False) -> "Dataset":
+        """
+        Create a new dataset from a dataframe, serialising it straight into the cache in the
+        format given by `file_extension`. Set `canonical` to always get the same file (and md5)
+        for the same data, see `frames.canonicalize`.
+        """
+        if isinstance(metadata, dict):
+            dataset = Dataset.from_dict(metadata)  # type: ignore
+        else:
+            dataset = metadata
+
+        # write the file into the cache and set the md5
+        dataset.md5 = dataset.write_to_cache(df, canonical=canonical)
 
         return dataset
 
@@ -146,16 +190,43 @@ class Dataset:
             meta = yaml.safe_load(istream)
             return cls(**meta)
 
-    def add_to_cache(self, filename: str) -> None:
+    def add_to_cache(self, filename: str, move: bool = False) -> str:
         """
-        Copy the pre-downloaded file into the cache. This avoids having to
-        redownload it if you already have a copy.
+        Copy the pre-downloaded file into the cache and return its checksum. This avoids
+        having to redownload it if you already have a copy.
         """
         cache_file = self.local_path
 
         # make the parent folder
         create(cache_file)
-        shutil.copy(filename, cache_file)
+        return files.copy_and_checksum(filename, cache_file, move=move)
+
+    def write_to_cache(self, df: pd.DataFrame, canonical: bool = False) -> str:
+        """
+        Serialise the dataframe into the cache and return its checksum. Where the format
+        allows it, the checksum is computed as the file is written.
+        """
+        cache_file = self.local_path
+
+        # make the parent folder
+        create(cache_file)
+
+        # write to a temporary file first so that a failure never leaves a partial file in the cache
+        if not frames.is_streamable(self.file_extension):
+            # the format is chosen from the extension, so the temporary file keeps it
+            tmp_file = f"{path.splitext(cache_file)[0]}.tmp.{self.file_extension}"
+            frames.to_file(frames.canonicalize(df) if canonical else df, tmp_file)
+            os.replace(tmp_file, cache_file)
+            return files.checksum(cache_file)
+
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "wb") as ostream:
+            writer = files.HashingWriter(ostream)
+            frames.to_stream(df, writer, self.file_extension, canonical=canonical)  # type: ignore
+
+        os.replace(tmp_file, cache_file)
+
+        return writer.hexdigest()
 
     @property
     def metadata(self) -> Dict[str, Any]:
@@ -166,7 +237,9 @@ class Dataset:
         "Save any changes as JSON to the catalog."
         create(self.index_path)
         with open(self.index_path, "w") as ostream:
-            print(json.dumps(self.metadata, indent=2, default=str), file=ostream)  # type: ignore
+            print(files.json_dumps(self.metadata, indent=2, default=str), file=ostream)  # type: ignore
+
+        self._update_bundle()
 
     def delete(self) -> None:
         """
@@ -175,6 +248,12 @@ class Dataset:
         """
         if path.exists(self.index_path):
             delete(self.index_path)
+            self._update_bundle()
+
+    def _update_bundle(self) -> None:
+        "Keep the bundle of our namespace in sync with the index, if we use bundles."
+        if BUNDLE_DIR:
+            bundles.build(INDEX_DIR, BUNDLE_DIR, namespaces=[self.namespace])
 
     @property
     def index_path(self) -> str:
@@ -199,14 +278,31 @@ class Dataset:
             url = self.owid_data_url or self.source_data_url
             if not url:
                 raise Exception(f"dataset {self.name} has neither source_data_url nor owid_data_url")
-            if self.is_public:
-                files.download(url, filename, expected_md5=self.md5, quiet=quiet)
-            else:
-                owid_cache.download(url, filename, expected_md5=self.md5, quiet=quiet)
+            decompress = self.transport_compression if url == self.owid_data_url else None
+            if decompress:
+                # fail before downloading anything we could not decompress
+                try:
+                    files.check_compression(decompress)
+                except ImportError:
+                    raise ImportError(
+                        f"dataset {self.relative_base} is stored {decompress}-compressed, which needs the zstandard"
+                        " package: `pip install zstandard`, or install walden with the `compression` extra"
+                    )
+            storage.for_url(url).download(
+                url, filename, expected_md5=self.md5, quiet=quiet, public=bool(self.is_public), decompress=decompress
+            )
 
         return filename
 
-    def upload(self, public: bool = False, check_changed: bool = False) -> bool:
+    def upload(
+        self,
+        public: bool = False,
+        check_changed: bool = False,
+        profile: bool = True,
+        multipart_chunksize: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        compress: bool = False,
+    ) -> bool:
         """Copy the local file to our cache. It updates the `owid_data_url` field.
 
         Arguments:
@@ -215,6 +311,19 @@ class Dataset:
             If True, the file will be uploaded to the public database. Otherwise, it will be uploaded to the private database. Defaults to False.
         check_changed: bool
             If True, the file will only be uploaded if it has changed since the last upload. Defaults to False.
+        profile: bool
+            If True and the file is tabular, also upload a profile of its contents (see `add_profile`). Failing to
+            profile only logs a warning, since the data is already uploaded. Defaults to True.
+        multipart_chunksize: int
+            Size in bytes of each part of the upload. Defaults to `owid_cache.MULTIPART_CHUNKSIZE` (64MB, or the
+            `WALDEN_MULTIPART_CHUNKSIZE_MB` env var).
+        max_concurrency: int
+            Number of parts uploaded at once. Defaults to `owid_cache.MAX_CONCURRENCY` (16, or the
+            `WALDEN_MAX_CONCURRENCY` env var).
+        compress: bool
+            If True, store the file zstd-compressed, which makes large text files much faster to transfer. The
+            file is decompressed again by `ensure_downloaded`, so `md5` and the local copy do not change. Needs the
+            `zstandard` package. Defaults to False.
 
         Returns:
         --------
@@ -222,12 +331,31 @@ class Dataset:
             True if the file was uploaded, False otherwise.
         """
         if (check_changed and self.has_changed_from_last_version()) or not check_changed:
-            # download the file to the local cache if we don't have it already
-            self.ensure_downloaded()
-
-            # add it to our remote cache of data files
-            dest_path = f"{self.relative_base}.{self.file_extension}"
-            cache_url = owid_cache.upload(self.local_path, dest_path, public=public)
+            self.transport_compression = "zstd" if compress else None
+            dest_path = self._remote_path()
+            remote = storage.get_storage()
+
+            source = self._find_remote_copy(remote, dest_path)
+            source_profile_path = source[1] if source else None
+            if source:
+                # the same content is already in our remote cache, copy it there without uploading
+                cache_url = remote.copy(source[0], dest_path, public=public, md5=self.md5)
+            elif self.transport_compression:
+                self.ensure_downloaded()
+                cache_url = self._upload_compressed(remote, dest_path, public=public)
+            else:
+                # download the file to the local cache if we don't have it already
+                self.ensure_downloaded()
+
+                # add it to our remote cache of data files
+                cache_url = remote.upload(
+                    self.local_path,
+                    dest_path,
+                    public=public,
+                    multipart_chunksize=multipart_chunksize,
+                    max_concurrency=max_concurrency,
+                    md5=self.md5,
+                )
 
             # remember how to access it
             self.owid_data_url = cache_url
@@ -235,11 +363,101 @@ class Dataset:
             # Set attribute to public
             self.is_public = public
 
+            # store a lightweight summary of tabular data next to it
+            if profile and profiling.is_tabular(self.file_extension):
+                self._try_upload_profile(public=public, source_profile_path=source_profile_path)
+
+            if self.md5:
+                _stored_urls(self.md5, self.transport_compression).append((cache_url, self.owid_profile_url))
+
             # Return True because the file was uploaded
             return True
         # Return False because the file was not uploaded
         return False
 
+    def download_and_upload(self, public: bool = True, profile: bool = True) -> None:
+        """
+        Download the file from `source_data_url` into the cache while streaming it into our
+        remote cache, computing its md5 on the way. This takes about as long as the download
+        alone, instead of downloading, checksumming and then uploading one after the other.
+        If the md5 is already known and the remote copy has it, only the download happens. As
+        with `upload`, a profile of tabular data is stored next to it. It updates the `md5`,
+        `owid_data_url` and `owid_profile_url` fields.
+        """
+        if not self.source_data_url:
+            raise ValueError(f"dataset {self.name} has no source_data_url")
+
+        filename = self.local_path
+        create(filename)
+
+        self.transport_compression = None
+        dest_path = self._remote_path()
+        remote = storage.get_storage()
+
+        if self.md5 and remote.md5(dest_path) == self.md5:
+            log.info("Skipping upload, unchanged", path=dest_path, md5=self.md5)
+            files.download(self.source_data_url, filename, expected_md5=self.md5)
+            self.owid_data_url = remote.url(dest_path)
+        else:
+            uploader = remote.open_upload(dest_path, public=public, md5=self.md5)
+            try:
+                md5 = files.download(self.source_data_url, filename, expected_md5=self.md5, tee=uploader)
+            except BaseException:
+                uploader.abort()
+                raise
+
+            self.owid_data_url = uploader.complete(md5)
+            self.md5 = md5
+
+        self.is_public = public
+
+        if profile and profiling.is_tabular(self.file_extension):
+            self._try_upload_profile(public=public)
+
+        _stored_urls(self.md5, None).append((self.owid_data_url, self.owid_profile_url))
+
+    def _upload_compressed(self, remote: storage.Storage, dest_path: str, public: bool) -> str:
+        "Stream the cached file through the compressor into our remote cache, returning its URL."
+        if remote.md5(dest_path) == self.md5:
+            log.info("Skipping upload, unchanged", path=dest_path, md5=self.md5)
+            return remote.url(dest_path)
+
+        uploader = remote.open_upload(dest_path, public=public, md5=self.md5)
+        try:
+            files.compress(self.local_path, uploader, self.transport_compression)  # type: ignore
+        except BaseException:
+            uploader.abort()
+            raise
+
+        return uploader.complete(self.md5)  # type: ignore
+
+    def _remote_path(self) -> str:
+        "Path of the data file in our remote cache, with a suffix for its transport compression."
+        dest_path = f"{self.relative_base}.{self.file_extension}"
+        if self.transport_compression:
+            dest_path += "." + files.COMPRESSIONS[self.transport_compression]
+        return dest_path
+
+    def _find_remote_copy(self, remote: storage.Storage, dest_path: str) -> Optional[Tuple[str, Optional[str]]]:
+        """
+        Find another dataset in the catalog with the same content that is stored in our
+        remote cache, and return its path there and that of its profile, if any.
+        """
+        if not self.md5:
+            return None
+
+        # only a copy stored the same way can be reused as is
+        for url, profile_url in _stored_urls(self.md5, self.transport_compression):
+            source_path = remote.relative_path(url)
+            if not source_path or source_path == dest_path:
+                continue
+
+            # make sure the object is really there with that content
+            if remote.md5(source_path) == self.md5:
+                return source_path, remote.relative_path(profile_url) if profile_url else None
+
+        return None
+
     def upload_and_save(self, upload: bool, public: bool = False, check_changed: bool = True) -> None:
         """Update index and upload dataset if required.
 
@@ -266,8 +484,78 @@ class Dataset:
         """
         Delete the file from the remote cache on S3.
         """
-        dest_path = f"{self.relative_base}.{self.file_extension}"
-        owid_cache.delete(dest_path)
+        dest_paths = [self._remote_path()]
+        if self.owid_profile_url:
+            dest_paths.append(f"{self.relative_base}.profile.json")
+
+        storage.get_storage().delete(dest_paths)
+
+    def add_profile(self, df: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
+        """
+        Compute a profile of the data (columns, dtypes, row count, year range, countries)
+        and store it next to the data file in the local cache. Pass the dataframe if you
+        already have it in memory, otherwise the cached file is read.
+        """
+        if df is None:
+            profile = profiling.profile_file(self.ensure_downloaded(), self.file_extension, md5=self.md5)
+        else:
+            profile = profiling.profile_frame(df, md5=self.md5)
+
+        create(self.profile_path)
+        profiling.save(profile, self.profile_path)
+
+        return profile
+
+    def upload_profile(self, public: bool = False) -> None:
+        """
+        Upload the profile of the data next to the data file, computing it first if needed.
+        It updates the `owid_profile_url` field.
+        """
+        if not self._has_local_profile():
+            self.add_profile()
+
+        dest_path = f"{self.relative_base}.profile.json"
+        self.owid_profile_url = storage.get_storage().upload(
+            self.profile_path, dest_path, public=public, md5=files.checksum(self.profile_path)
+        )
+
+    def _try_upload_profile(self, public: bool, source_profile_path: Optional[str] = None) -> None:
+        """
+        Upload the profile, or copy that of a stored copy of the same content at `source_profile_path`
+        without reading the data. Only warn on failure since the data itself is already stored.
+        """
+        try:
+            if source_profile_path:
+                self.owid_profile_url = storage.get_storage().copy(
+                    source_profile_path, f"{self.relative_base}.profile.json", public=public
+                )
+            else:
+                self.upload_profile(public=public)
+        except Exception as e:
+            log.warning("Could not profile dataset", path=self.relative_base, error=str(e))
+
+    def load_profile(self) -> Dict[str, Any]:
+        """
+        Return the profile of the data, fetching only the small sidecar file if we don't
+        have it yet, so that the data itself does not need to be downloaded.
+        """
+        if not self._has_local_profile():
+            if not self.owid_profile_url:
+                raise ValueError(f"dataset {self.relative_base} has no profile")
+
+            create(self.profile_path)
+            storage.for_url(self.owid_profile_url).download(
+                self.owid_profile_url, self.profile_path, quiet=True, public=bool(self.is_public)
+            )
+
+        return profiling.load(self.profile_path)
+
+    def _has_local_profile(self) -> bool:
+        return path.exists(self.profile_path) and profiling.load(self.profile_path).get("md5") == self.md5
+
+    @property
+    def profile_path(self) -> str:
+        return path.join(CACHE_DIR, f"{self.relative_base}.profile.json")
 
     @property
     def local_path(self) -> str:
@@ -315,12 +603,111 @@ class Dataset:
 
 
 class Catalog:
-    def __init__(self):
+    def __init__(self, bundle_dir: Optional[str] = None, remote: bool = False):
+        """
+        Load every dataset in the index, from the NDJSON bundles in `bundle_dir` (or `BUNDLE_DIR`)
+        if given. Set `remote` to load the bundle published to our bucket instead, which only
+        needs one conditional request when our copy of it is current.
+        """
+        self.bundle_dir = bundle_dir
+        self.remote = remote
         self.datasets: List[Dataset] = []
+        self.selectors: Optional[Dict[str, str]] = None
         self.refresh()
 
     def refresh(self):
-        self.datasets = [Dataset.from_dict(d) for _, d in iter_docs()]  # type: ignore
+        docs = iter_remote_docs() if self.remote else iter_docs(self.bundle_dir)
+        self.datasets = [Dataset.from_dict(d) for _, d in docs]  # type: ignore
+
+    @classmethod
+    def from_docs(cls, docs: Iterable[Tuple[str, dict]]) -> "Catalog":
+        "A catalog of the given documents, e.g. from another index folder or a git revision, see `diff`."
+        catalog = cls.__new__(cls)
+        catalog.bundle_dir = None
+        catalog.remote = False
+        catalog.datasets = [Dataset.from_dict(d) for _, d in docs]  # type: ignore
+        catalog.selectors = None
+        return catalog
+
+    @classmethod
+    def from_lock(cls, filename: str = LOCK_FILE, selectors: Optional[Iterable[str]] = None) -> "Catalog":
+        """
+        A catalog of only the datasets pinned in a lockfile, see `lock`. It does not read the
+        index at all, and `resolve` on it gives the dataset recorded for each selector. Pass
+        the `selectors` you need to make sure up front that they are all in the lockfile.
+        """
+        lock = files.load_json(filename)
+        catalog = cls.from_docs((filename, doc) for doc in lock["datasets"])
+        catalog.selectors = lock["selectors"]
+
+        pinned = {dataset.relative_base for dataset in catalog}
+        for selector, relative_base in catalog.selectors.items():
+            if relative_base not in pinned:
+                raise ValueError(f"{filename} pins {selector} to {relative_base}, which it does not contain")
+
+        for selector in selectors or []:
+            catalog.resolve(selector)
+
+        return catalog
+
+    def lock(self, selectors: Iterable[str], filename: str = LOCK_FILE) -> Dict[str, Any]:
+        """
+        Resolve each selector to one exact dataset and write them to a lockfile, so that later
+        runs get the very same data with `from_lock`, even after new versions are added. A
+        selector is "namespace/version/short_name", where version can be "latest", or
+        "namespace/short_name" for the latest version.
+        """
+        resolved = {selector: self.resolve(selector) for selector in sorted(set(selectors))}
+
+        datasets = {dataset.relative_base: dataset for dataset in resolved.values()}
+        lock = {
+            "selectors": {selector: dataset.relative_base for selector, dataset in resolved.items()},
+            "datasets": [datasets[key].metadata for key in sorted(datasets)],
+        }
+
+        with open(filename, "w") as ostream:
+            print(files.json_dumps(lock, indent=2, default=str), file=ostream)
+
+        return lock
+
+    def resolve(self, selector: str) -> Dataset:
+        "Find the dataset for a selector, see `lock`, or the one pinned for it if loaded `from_lock`."
+        if self.selectors is not None:
+            if selector not in self.selectors:
+                raise KeyError(f"{selector} is not in the lockfile, please add it with Catalog().lock")
+            return next(dataset for dataset in self if dataset.relative_base == self.selectors[selector])
+
+        parts = selector.split("/")
+        if len(parts) == 2:
+            namespace, short_name = parts
+            version = "latest"
+        elif len(parts) == 3:
+            namespace, version, short_name = parts
+        else:
+            raise ValueError(f"invalid selector {selector}, expected namespace/version/short_name")
+
+        if version == "latest":
+            return self.find_latest(namespace=namespace, short_name=short_name)
+
+        return self.find_one(namespace=namespace, version=version, short_name=short_name)
+
+    def diff(self, other: "Catalog") -> Iterator[Dict[str, Any]]:
+        """
+        Describe how `other` differs from this catalog: datasets only in `other` are "added",
+        those only in this one "removed", and those in both but with a different md5 or stored
+        elsewhere "changed". Datasets are matched by namespace, version and short name.
+        """
+        ours = {dataset.relative_base: dataset for dataset in self}
+        theirs = {dataset.relative_base: dataset for dataset in other}
+
+        for key in sorted(ours.keys() | theirs.keys()):
+            old, new = ours.get(key), theirs.get(key)
+            if old is None:
+                yield _change("added", new)  # type: ignore
+            elif new is None:
+                yield _change("removed", old)
+            elif (old.md5, old.owid_data_url) != (new.md5, new.owid_data_url):
+                yield dict(_change("changed", new), previous_md5=old.md5, previous_owid_data_url=old.owid_data_url)
 
     def __iter__(self):
         yield from iter(self.datasets)
@@ -372,15 +759,53 @@ class Catalog:
         return dataset
 
 
+def _change(change: str, dataset: Dataset) -> Dict[str, Any]:
+    return {
+        "change": change,
+        "namespace": dataset.namespace,
+        "version": dataset.version,
+        "short_name": dataset.short_name,
+        "md5": dataset.md5,
+        "owid_data_url": dataset.owid_data_url,
+    }
+
+
+def _stored_urls(md5: str, transport_compression: Optional[str]) -> List[Tuple[str, Optional[str]]]:
+    """
+    The URLs where datasets in the catalog with this content are stored, with those of their
+    profiles, reading the catalog only the first time, so that uploading many datasets does not
+    load it again each time.
+    """
+    global _stored_copies
+    if _stored_copies is None:
+        _stored_copies = {}
+        for dataset in Catalog():
+            if dataset.md5 and dataset.owid_data_url:
+                key = (dataset.md5, dataset.transport_compression)
+                _stored_copies.setdefault(key, []).append((dataset.owid_data_url, dataset.owid_profile_url))
+
+    return _stored_copies.setdefault((md5, transport_compression), [])
+
+
 def load_schema() -> dict:
-    with open(SCHEMA_FILE) as istream:
-        return json.load(istream)
+    return files.load_json(SCHEMA_FILE)
 
 
-def iter_docs() -> Iterator[Tuple[str, dict]]:
+def iter_docs(bundle_dir: Optional[str] = None) -> Iterator[Tuple[str, dict]]:
+    bundle_dir = bundle_dir or BUNDLE_DIR
+    if bundle_dir:
+        return bundles.iter_docs(bundle_dir, INDEX_DIR)
+
     return files.iter_docs(INDEX_DIR)
 
 
+def iter_remote_docs() -> Iterator[Tuple[str, dict]]:
+    "Iterate over the documents of the catalog published to our bucket, see `bundles.publish`."
+    bundle = bundles.fetch_remote(path.join(CACHE_DIR, bundles.REMOTE_BUNDLE_KEY))
+    for relative_path, doc in files.iter_docs(bundle):
+        yield path.join(INDEX_DIR, relative_path), doc
+
+
 def create(filename) -> None:
     """
     Create directory to file. E.g., for filename 'a/b/c/file.csv' it will make sure 'a/b/c' exists.
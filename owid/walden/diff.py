@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  diff.py
+#  walden
+#
+#  Compare two states of the catalog and print the datasets that were added, removed or
+#  changed as NDJSON, so that downstream pipelines can rebuild only what is affected.
+#  Each state can be an index folder, a bundle (see `bundles`) or a git revision.
+#
+
+import os
+import subprocess
+from os import path
+from typing import Iterator, Optional, Tuple
+
+import click
+
+from owid.walden import bundles, catalog, files
+from owid.walden.catalog import Catalog
+
+
+@click.command()
+@click.argument("old")
+@click.argument("new", required=False)
+def diff(old: str, new: Optional[str] = None) -> None:
+    """
+    Print the changes between catalog states OLD and NEW, one JSON object per line. Each
+    state is an index folder, a bundle folder, a bundle file or a git revision; NEW defaults
+    to the index in this checkout.
+    """
+    old_catalog = load(old)
+    new_catalog = load(new) if new else Catalog()
+
+    for change in old_catalog.diff(new_catalog):
+        print(files.json_dumps(change))
+
+
+def load(state: str) -> Catalog:
+    "Load the catalog from an index folder, a bundle folder or file, or otherwise a git revision."
+    return Catalog.from_docs(iter_state_docs(state))
+
+
+def iter_state_docs(state: str) -> Iterator[Tuple[str, dict]]:
+    if path.isfile(state):
+        return files.iter_docs(state)
+
+    if path.isdir(state):
+        if any(name.endswith(bundles.BUNDLE_EXTENSION) for name in os.listdir(state)):
+            return bundles.iter_docs(state, catalog.INDEX_DIR)
+        return files.iter_docs(state)
+
+    return iter_git_docs(state)
+
+
+def iter_git_docs(ref: str) -> Iterator[Tuple[str, dict]]:
+    """
+    Iterate over the documents of the index at a git revision, reading them all with a
+    single `git cat-file` process instead of checking the revision out.
+    """
+    repo_dir = _git("rev-parse", "--show-toplevel").decode().strip()
+    listing = _git("ls-tree", "-r", "-z", "--name-only", "--full-name", ref, "--", catalog.INDEX_DIR)
+    names = [name for name in listing.decode().split("\0") if name.endswith(".json")]
+    if not names:
+        return
+
+    output = _git("cat-file", "--batch", input="".join(f"{ref}:{name}\n" for name in names).encode())
+
+    # each object is a header line "<sha> blob <size>", its contents and a newline
+    offset = 0
+    for name in names:
+        end_of_header = output.index(b"\n", offset)
+        size = int(output[offset:end_of_header].split()[2])
+        contents = output[end_of_header + 1 : end_of_header + 1 + size]
+        offset = end_of_header + 1 + size + 1
+
+        try:
+            yield path.join(repo_dir, name), files.json_loads(contents)
+        except ValueError:
+            raise files.RecordWithInvalidJSON(f"{ref}:{name}")
+
+
+def _git(*args: str, input: Optional[bytes] = None) -> bytes:
+    return subprocess.run(["git", *args], cwd=catalog.BASE_DIR, input=input, check=True, capture_output=True).stdout
+
+
+if __name__ == "__main__":
+    diff()
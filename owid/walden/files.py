@@ -4,12 +4,15 @@
 #  Helpers for downloading and dealing with files.
 #
 
+import gzip
 import hashlib
+import io
 import json
 import os
+import re
 import shutil
 from os import path, walk
-from typing import IO, Iterator, Optional, Tuple
+from typing import IO, Any, Callable, Iterator, Optional, Tuple, Union
 
 import requests
 from rich.progress import (
@@ -22,6 +25,27 @@ from rich.progress import (
 
 from .ui import log
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+# JSON codec for `json_loads` and `json_dumps`: orjson when installed, unless set to "json"
+JSON_BACKEND = os.environ.get("WALDEN_JSON_BACKEND", "orjson" if orjson else "json")
+
+# supported transport compressions and the extension they add to files
+COMPRESSIONS = {"zstd": "zst"}
+
+# pooled HTTP session, see `_session()`, and how many connections it keeps open per host
+_http_session: Optional[requests.Session] = None
+MAX_POOL_CONNECTIONS = 16
+
+# maximum number of keys S3 accepts in a single delete_objects request
+DELETE_BATCH_SIZE = 1000
+
+# ioctl request to clone a file with copy-on-write (reflink) on Linux, e.g. on btrfs or xfs
+FICLONE = 0x40049409
+
 
 def _create_progress_bar() -> Progress:
     """Create a fancy progress bar to use for display of download progress.
@@ -44,14 +68,16 @@ def _stream_to_file(
     file: IO[bytes],
     chunk_size: int = 2**14,
     progress_bar_min_bytes: int = 2**25,
+    md5: Optional["hashlib._Hash"] = None,
 ) -> str:
     """Stream the response to the file, returning the checksum.
     :param progress_bar_min_bytes: Minimum number of bytes to display a progress bar for. Default is 32MB
+    :param md5: Checksum of what is already in the file, when resuming a download
     """
     # check header to get content length, in bytes
     total_length = int(r.headers.get("content-length", 0))
 
-    md5 = hashlib.md5()
+    md5 = md5 or hashlib.md5()
 
     streamer = r.iter_content(chunk_size=chunk_size)
     display_progress = total_length > progress_bar_min_bytes
@@ -72,54 +98,394 @@ def _stream_to_file(
     return md5.hexdigest()
 
 
-def download(url: str, filename: str, expected_md5: Optional[str] = None, quiet: bool = False) -> None:
-    "Download the file at the URL to the given local filename."
+def download(
+    url: str,
+    filename: str,
+    expected_md5: Optional[str] = None,
+    quiet: bool = False,
+    tee: Optional[IO[bytes]] = None,
+    decompress: Optional[str] = None,
+) -> str:
+    """Download the file at the URL to the given local filename, returning its checksum.
+
+    Connections are pooled across downloads, and an interrupted download is resumed with a
+    range request where the server supports it, as long as we can tell that the file did not
+    change in between: by its ETag, or otherwise by the expected checksum. Pass `tee` to
+    also write every chunk to another stream as it arrives (this disables resuming). Pass
+    `decompress="zstd"` to decompress a compressed file as it arrives; the checksum is then
+    that of the decompressed file.
+    """
     # NOTE: we are not streaming to a NamedTemporaryFile because it was causing weird
     # issues one some systems, it's safer to stream directly to the file and remove it
     # if md5 don't match
     tmp_filename = filename + ".tmp"
-    with open(tmp_filename, "wb") as f, requests.get(url, stream=True) as r:
-        r.raise_for_status()
 
-        md5 = _stream_to_file(r, f)
+    # the ETag of the file that the partial download belongs to
+    etag_filename = tmp_filename + ".etag"
+    etag = _read_text(etag_filename) if os.path.exists(etag_filename) else None
+
+    # pick up where a previous attempt left off
+    resumable = not tee and not decompress
+    resume_from = 0
+    if resumable and (etag or expected_md5) and os.path.exists(tmp_filename):
+        resume_from = os.path.getsize(tmp_filename)
+
+    headers = {}
+    if resume_from:
+        headers["Range"] = f"bytes={resume_from}-"
+        if etag:
+            # the server sends the whole file instead if it changed since
+            headers["If-Range"] = etag
+
+    r = _session().get(url, stream=True, headers=headers)
+    if r.status_code == 416:
+        # what we have does not fit the file on the server, start again from zero
+        r.close()
+        r = _session().get(url, stream=True)
+
+    with r:
+        r.raise_for_status()
 
-        if expected_md5 and md5 != expected_md5:
-            if os.path.exists(filename):
-                os.remove(filename)
-            raise ChecksumDoesNotMatch(
-                f"for file downloaded from {url}. Is your walden repository up to date?\n\twalden index checksum = {expected_md5}\n\tdownloaded checksum = {md5}"
-                ""
-            )
+        if r.status_code == 206 and resume_from:
+            md5 = hashlib.md5()
+            with open(tmp_filename, "rb") as f:
+                _update_checksum(md5, f)
+            with open(tmp_filename, "ab") as f:
+                md5_hex = _stream_to_file(r, f, md5=md5)
+        elif decompress:
+            with open(tmp_filename, "wb") as f:
+                sink = HashingWriter(f)
+                with decompressing_writer(sink, decompress) as writer:
+                    _stream_to_file(r, writer)
+                md5_hex = sink.hexdigest()
+        else:
+            # a full response, also when the file changed since the partial download
+            _forget(etag_filename)
+            if resumable and r.headers.get("ETag"):
+                _write_text(r.headers["ETag"], etag_filename)
+
+            with open(tmp_filename, "wb") as f:
+                md5_hex = _stream_to_file(r, Tee(f, tee) if tee else f)  # type: ignore
+
+    if expected_md5 and md5_hex != expected_md5:
+        for stale_file in (filename, tmp_filename, etag_filename):
+            _forget(stale_file)
+        raise ChecksumDoesNotMatch(
+            f"for file downloaded from {url}. Is your walden repository up to date?\n\twalden index checksum = {expected_md5}\n\tdownloaded checksum = {md5_hex}"
+            ""
+        )
 
     shutil.move(tmp_filename, filename)
+    _forget(etag_filename)
 
     if not quiet:
         log("DOWNLOADED", f"{url} -> {filename}")
 
+    return md5_hex
+
+
+def _session() -> requests.Session:
+    "A session shared by all downloads, so that connections to the same host are reused."
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=MAX_POOL_CONNECTIONS, pool_maxsize=MAX_POOL_CONNECTIONS
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_session = session
+
+    return _http_session
+
+
+def _read_text(filename: str) -> str:
+    with open(filename) as istream:
+        return istream.read()
+
+
+def _write_text(text: str, filename: str) -> None:
+    with open(filename, "w") as ostream:
+        ostream.write(text)
+
+
+def _forget(filename: str) -> None:
+    if os.path.exists(filename):
+        os.remove(filename)
+
 
 def checksum(local_path: str) -> str:
-    md5 = hashlib.md5()
-    chunk_size = 2**20  # 1MB
     with open(local_path, "rb") as f:
-        chunk = f.read(chunk_size)
+        return _checksum_stream(f)
+
+
+def compress(filename: str, ostream: IO[bytes], compression: str = "zstd", chunk_size: int = 2**20) -> None:
+    "Write a compressed copy of the file to the stream, without ever holding it all in memory."
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unknown compression {compression}")
+
+    with open(filename, "rb") as istream, _zstd().ZstdCompressor().stream_writer(ostream, closefd=False) as writer:
+        chunk = istream.read(chunk_size)
         while chunk:
-            md5.update(chunk)
-            chunk = f.read(chunk_size)
+            writer.write(chunk)
+            chunk = istream.read(chunk_size)
+
+
+def decompressing_writer(ostream: IO[bytes], compression: str = "zstd"):
+    "A writable stream that decompresses what it is given into `ostream`; close it when done."
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unknown compression {compression}")
+
+    return _zstd().ZstdDecompressor().stream_writer(ostream, closefd=False)
+
+
+def check_compression(compression: str) -> None:
+    "Make sure that files can be compressed and decompressed this way, before transferring anything."
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unknown compression {compression}")
+
+    _zstd()
+
+
+def _zstd():
+    # optional dependency, only needed for compressed transfers
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            "compressed transfers need the zstandard package, please `pip install zstandard` "
+            "or install walden with the `compression` extra"
+        )
+
+    return zstandard
+
+
+def copy_and_checksum(src: str, dst: str, move: bool = False) -> str:
+    """Copy (or move) the file to the destination, returning its checksum.
+
+    The file is read only once: when moving or reflinking, only the checksum reads it, and
+    otherwise the checksum is computed from the same chunks that are copied.
+    """
+    if path.abspath(src) == path.abspath(dst):
+        return checksum(src)
+
+    if move:
+        try:
+            os.replace(src, dst)
+            return checksum(dst)
+        except OSError:
+            # different filesystems, fall back to copying
+            pass
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if _reflink(fsrc, fdst):
+            md5 = _checksum_stream(fsrc)
+        else:
+            md5 = _copy_with_checksum(fsrc, fdst)
+
+    shutil.copymode(src, dst)
+    if move:
+        os.remove(src)
+
+    return md5
+
+
+def _reflink(fsrc: IO[bytes], fdst: IO[bytes]) -> bool:
+    "Try to clone the file with copy-on-write, which copies no data at all."
+    try:
+        import fcntl
+
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def _copy_with_checksum(fsrc: IO[bytes], fdst: IO[bytes], chunk_size: int = 2**20) -> str:
+    md5 = hashlib.md5()
+
+    # let the kernel copy the data where it can, only reading each chunk back from the
+    # page cache to checksum it
+    if hasattr(os, "copy_file_range"):
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        offset = 0
+        try:
+            while True:
+                copied = os.copy_file_range(src_fd, dst_fd, chunk_size, offset, offset)  # type: ignore
+                if not copied:
+                    return md5.hexdigest()
+                md5.update(os.pread(src_fd, copied, offset))
+                offset += copied
+        except OSError:
+            if offset > 0:
+                raise
+            # not supported between these files, fall back to a plain copy
+
+    chunk = fsrc.read(chunk_size)
+    while chunk:
+        md5.update(chunk)
+        fdst.write(chunk)
+        chunk = fsrc.read(chunk_size)
 
     return md5.hexdigest()
 
 
+def _checksum_stream(f: IO[bytes]) -> str:
+    md5 = hashlib.md5()
+    _update_checksum(md5, f)
+    return md5.hexdigest()
+
+
+def _update_checksum(md5: "hashlib._Hash", f: IO[bytes], chunk_size: int = 2**20) -> None:
+    "Add the rest of the stream to the checksum."
+    chunk = f.read(chunk_size)
+    while chunk:
+        md5.update(chunk)
+        chunk = f.read(chunk_size)
+
+
+class Tee:
+    "A writable stream that writes everything to several other streams."
+
+    def __init__(self, *streams: IO[bytes]):
+        self._streams = streams
+
+    def write(self, b) -> int:
+        for stream in self._streams:
+            stream.write(b)
+        return len(b)
+
+
+class HashingWriter(io.RawIOBase):
+    """
+    A writable binary stream that passes everything through to the underlying file,
+    computing its checksum on the way, so that we never need to read the file back.
+    """
+
+    def __init__(self, f: IO[bytes]):
+        self._f = f
+        self._md5 = hashlib.md5()
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:  # type: ignore
+        self._md5.update(b)
+        self._f.write(b)
+        n = len(memoryview(b).cast("B"))
+        self._position += n
+        return n
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        self._f.flush()
+
+    def hexdigest(self) -> str:
+        return self._md5.hexdigest()
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    "Parse a JSON document, with orjson if it is available."
+    if JSON_BACKEND == "orjson":
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. NaN or integers beyond 64 bits, which the json module accepts
+            pass
+
+    return json.loads(data)
+
+
+def json_dumps(
+    obj: Any, indent: Optional[int] = None, sort_keys: bool = False, default: Optional[Callable] = None
+) -> str:
+    """
+    Serialise to JSON, with orjson if it is available. The output is the same as the json
+    module's with `ensure_ascii`, so that files do not change with the backend: pretty-printed
+    with an `indent` of 2, or compact (no spaces after separators) without one. NaN and
+    infinity, which are not valid JSON, become null with orjson.
+    """
+    # floats that the json module writes in scientific notation come out differently with orjson
+    if JSON_BACKEND == "orjson" and indent in (None, 2) and not _has_exponent_float(obj):
+        option = orjson.OPT_PASSTHROUGH_DATETIME
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+
+        try:
+            text = orjson.dumps(obj, default=default, option=option).decode("utf-8")
+        except orjson.JSONEncodeError:
+            # e.g. keys that are not strings, which the json module converts
+            pass
+        else:
+            return _NON_ASCII.sub(_escape_char, text)
+
+    separators = None if indent else (",", ":")
+    return json.dumps(obj, indent=indent, sort_keys=sort_keys, default=default, separators=separators)
+
+
+_NON_ASCII = re.compile(r"[^\x00-\x7e]")
+
+
+def _has_exponent_float(obj: Any) -> bool:
+    "Whether any float in the object has a repr, as written by the json module, in scientific notation."
+    if isinstance(obj, float):
+        return "e" in repr(obj)
+    elif isinstance(obj, dict):
+        return any(_has_exponent_float(value) for value in obj.values())
+    elif isinstance(obj, (list, tuple)):
+        return any(_has_exponent_float(value) for value in obj)
+
+    return False
+
+
+def _escape_char(match: "re.Match") -> str:
+    "Escape a character the way `json.dumps` does with `ensure_ascii`."
+    c = ord(match.group())
+    if c > 0xFFFF:
+        c -= 0x10000
+        return "\\u{:04x}\\u{:04x}".format(0xD800 | (c >> 10), 0xDC00 | (c & 0x3FF))
+    return "\\u{:04x}".format(c)
+
+
+def load_json(filename: str) -> Any:
+    with open(filename, "rb") as istream:
+        return json_loads(istream.read())
+
+
 def iter_docs(folder) -> Iterator[Tuple[str, dict]]:
-    "Iterate over the JSON documents in the catalog."
+    "Iterate over the JSON documents in the catalog, or in an NDJSON bundle of it (see `bundles`)."
+    if folder.endswith((".ndjson", ".ndjson.gz")):
+        yield from iter_bundle(folder)
+        return
+
     for filename in sorted(iter_json(folder)):
         try:
-            with open(filename) as istream:
-                yield filename, json.load(istream)
+            yield filename, load_json(filename)
 
         except json.decoder.JSONDecodeError:
             raise RecordWithInvalidJSON(filename)
 
 
+def iter_bundle(filename: str) -> Iterator[Tuple[str, dict]]:
+    "Iterate over the documents of an NDJSON bundle, gzipped or not, with their path relative to the index."
+    with (gzip.open(filename, "rb") if filename.endswith(".gz") else open(filename, "rb")) as istream:
+        for i, line in enumerate(istream):
+            if not line.strip():
+                continue
+
+            try:
+                entry = json_loads(line)
+            except json.decoder.JSONDecodeError:
+                raise RecordWithInvalidJSON(f"{filename}:{i + 1}")
+
+            yield entry["path"], entry["doc"]
+
+
 def iter_json(base_dir: str) -> Iterator[str]:
     for dirname, _, filenames in walk(base_dir):
         for filename in filenames:
@@ -5,37 +5,92 @@
 #  walden
 #
 
-import io
+import concurrent.futures
+import hashlib
 import json
+import os
+import subprocess
+from os import path
 from os.path import basename
-from typing import Iterator
+from typing import Iterator, List, Optional, Set, Tuple
 
 import click
 
 from owid.walden import catalog, files, ui
 
+# digests of file contents that are known to be well formatted, so that we can skip them,
+# together with the digest of the formatter that checked them, see `formatter_digest`
+CACHE_FILE = path.join(catalog.CACHE_DIR, "format_json.json")
+
+# below this many files to process, a worker pool costs more than it saves
+MIN_FILES_FOR_POOL = 256
+
 
 @click.command()
 @click.option("--check", is_flag=True, help="Only check, do not reformat")
-def format_json(check: bool = False) -> None:
+@click.option("--since", help="Only look at JSON files changed since this git ref, e.g. HEAD or origin/master")
+@click.option("--no-cache", is_flag=True, help="Process every file, even if it was well formatted last time")
+def format_json(check: bool = False, since: Optional[str] = None, no_cache: bool = False) -> None:
     """
     Reformat JSON files to a consistent readable standard.
     """
-    for filename in iter_json():
-        contents = read(filename)
-        try:
-            expected_contents = reformat(contents)
-        except json.JSONDecodeError:
+    filenames = list(iter_changed_json(since) if since else iter_json())
+
+    # skip files whose exact contents were well formatted last time
+    known_good = load_cache()
+    digests = {filename: digest(read_bytes(filename)) for filename in filenames}
+    results = process_all(
+        [filename for filename in filenames if no_cache or digests[filename] not in known_good], check
+    )
+
+    good = {d for d in digests.values() if d in known_good} | {d for _, _, d in results if d}
+    # a full run forgets the contents of files that have since changed
+    save_cache(known_good | good if since else good)
+
+    for filename, outcome, _ in results:
+        if outcome == "invalid":
             ui.bail(f"{basename(filename)} is not a valid JSON file")
 
-        if contents != expected_contents:
-            if check:
-                ui.bail(
-                    f"{basename(filename)} is not well formatted, please run " '"make format"',
-                )
+        if outcome == "unformatted":
+            ui.bail(
+                f"{basename(filename)} is not well formatted, please run " '"make format"',
+            )
 
+        if outcome == "reformatted":
             print(f"Reformatting {basename(filename)}")
-            write(expected_contents, filename)
+
+
+def process_all(filenames: List[str], check: bool) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Check or reformat the files, on a pool of worker processes if there are many. Return the
+    outcome for each file, together with the digest of its contents once well formatted.
+    """
+    to_process = [(filename, check) for filename in filenames]
+
+    if len(to_process) < MIN_FILES_FOR_POOL:
+        return [_process(args) for args in to_process]
+
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        return list(executor.map(_process, to_process, chunksize=16))
+
+
+def _process(args: Tuple[str, bool]) -> Tuple[str, str, Optional[str]]:
+    filename, check = args
+    contents = read(filename)
+    try:
+        expected_contents = reformat(contents)
+    except json.JSONDecodeError:
+        return filename, "invalid", None
+
+    good_digest = digest(expected_contents.encode("utf-8"))
+    if contents == expected_contents:
+        return filename, "ok", good_digest
+
+    if check:
+        return filename, "unformatted", None
+
+    write(expected_contents, filename)
+    return filename, "reformatted", good_digest
 
 
 def iter_json() -> Iterator[str]:
@@ -43,20 +98,43 @@ def iter_json() -> Iterator[str]:
     yield from files.iter_json(catalog.INDEX_DIR)
 
 
+def iter_changed_json(since: str) -> Iterator[str]:
+    "JSON files that changed since the given git ref, including ones not yet committed."
+    repo_dir = _git("rev-parse", "--show-toplevel")[0]
+    changed = _git("diff", "--name-only", "--diff-filter=ACMR", since, "--", "*.json")
+    untracked = _git("ls-files", "--others", "--exclude-standard", "--full-name", "--", "*.json")
+
+    wanted = set(iter_json())
+    for name in sorted(set(changed + untracked)):
+        filename = path.join(repo_dir, name)
+        if filename in wanted:
+            yield filename
+
+
+def _git(*args: str) -> List[str]:
+    output = subprocess.run(["git", *args], cwd=catalog.BASE_DIR, check=True, capture_output=True, text=True).stdout
+    return [line for line in output.splitlines() if line]
+
+
 def read(filename: str) -> str:
     with open(filename) as istream:
         return istream.read()
 
 
+def read_bytes(filename: str) -> bytes:
+    with open(filename, "rb") as istream:
+        return istream.read()
+
+
+def digest(contents: bytes) -> str:
+    return hashlib.md5(contents).hexdigest()
+
+
 def reformat(contents: str) -> str:
-    doc = json.loads(contents)
-    fake_file = io.StringIO()
-    json.dump(doc, fake_file, indent=2)
+    doc = files.json_loads(contents)
 
     # editors leave a newline at the end, we'll do the same
-    print(file=fake_file)
-
-    return fake_file.getvalue()
+    return files.json_dumps(doc, indent=2) + "\n"
 
 
 def write(expected_contents: str, filename: str) -> None:
@@ -64,5 +142,31 @@ def write(expected_contents: str, filename: str) -> None:
         ostream.write(expected_contents)
 
 
+def formatter_digest() -> str:
+    "Changes whenever the formatting could, so that files checked by an older formatter are checked again."
+    code = read_bytes(__file__) + read_bytes(files.__file__)
+    return digest(code + files.JSON_BACKEND.encode("utf-8"))
+
+
+def load_cache() -> Set[str]:
+    try:
+        with open(CACHE_FILE) as istream:
+            cache = json.load(istream)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return set()
+
+    if not isinstance(cache, dict) or cache.get("formatter") != formatter_digest():
+        return set()
+
+    return set(cache["known_good"])
+
+
+def save_cache(known_good: Set[str]) -> None:
+    os.makedirs(path.dirname(CACHE_FILE), exist_ok=True)
+    with open(CACHE_FILE + ".tmp", "w") as ostream:
+        json.dump({"formatter": formatter_digest(), "known_good": sorted(known_good)}, ostream)
+    os.replace(CACHE_FILE + ".tmp", CACHE_FILE)
+
+
 if __name__ == "__main__":
     format_json()
@@ -0,0 +1,199 @@
+#
+#  frames.py
+#
+#  Helpers for serialising dataframes into data files.
+#
+
+import hashlib
+import json
+from typing import IO
+
+import numpy as np
+import pandas as pd
+from owid.datautils import dataframes
+from owid.repack import repack_series, to_category, to_float, to_int
+
+from .ui import log
+
+# formats that pandas can write to an open binary file, so that we can hash them as they are written
+STREAMABLE_EXTENSIONS = ("csv", "feather", "parquet")
+
+
+def is_streamable(file_extension: str) -> bool:
+    return file_extension.lower() in STREAMABLE_EXTENSIONS
+
+
+def to_stream(df: pd.DataFrame, ostream: IO[bytes], file_extension: str, canonical: bool = False) -> None:
+    """Serialise the dataframe into an open binary file.
+
+    As in `owid.datautils.dataframes.to_file`, the index is only stored if the dataframe has
+    a meaningful one; feather files keep it as ordinary columns. With `canonical`, rows are sorted and volatile metadata is left out, so
+    that the same data always gives the same bytes (see `canonicalize`).
+    """
+    if canonical:
+        df = canonicalize(df)
+
+    file_extension = file_extension.lower()
+    if file_extension == "csv":
+        if canonical:
+            df.to_csv(ostream, index=has_index(df), encoding="utf-8", lineterminator="\n")  # type: ignore
+        else:
+            df.to_csv(ostream, index=has_index(df))  # type: ignore
+    elif file_extension == "feather":
+        # feather has no index, so a meaningful one is stored as ordinary columns
+        if has_index(df):
+            df = df.reset_index()
+
+        if canonical:
+            from pyarrow import feather
+
+            feather.write_feather(_to_arrow(df, preserve_index=False), ostream)
+        else:
+            df.to_feather(ostream)
+    elif file_extension == "parquet":
+        if canonical:
+            from pyarrow import parquet
+
+            parquet.write_table(_to_arrow(df, preserve_index=has_index(df)), ostream)
+        else:
+            df.to_parquet(ostream, index=has_index(df))
+    else:
+        raise ValueError(f"cannot stream dataframes to files with extension {file_extension}")
+
+
+def canonicalize(df: pd.DataFrame) -> pd.DataFrame:
+    """Return the rows of the dataframe in a canonical order, so that the same data
+    always serialises the same way regardless of the order it was fetched in.
+
+    Rows are sorted with a stable sort by the index, if meaningful, and then by every
+    column. Columns keep their order, since that is part of the data.
+    """
+    index_names = list(df.index.names) if has_index(df) else []
+    df = df.reset_index(drop=not index_names)
+
+    try:
+        df = df.sort_values(list(df.columns), kind="mergesort", na_position="last")
+    except TypeError:
+        # columns with values that cannot be compared, e.g. mixed types, so sort by a hash of each row
+        order = pd.util.hash_pandas_object(df, index=False).sort_values(kind="mergesort").index
+        df = df.loc[order]
+
+    df = df.reset_index(drop=True)
+    if index_names:
+        df = df.set_index(index_names)
+
+    return df
+
+
+def fingerprint(df: pd.DataFrame, ordered: bool = True) -> str:
+    """Return a hash of the contents of the dataframe, computed from vectorised row hashes
+    without serialising it. Unless `ordered`, the order of the rows is ignored.
+
+    Column names, dtypes and a meaningful index are part of the fingerprint.
+    """
+    index = has_index(df)
+    row_hashes = pd.util.hash_pandas_object(df, index=index).to_numpy()
+    if not ordered:
+        row_hashes = np.sort(row_hashes)
+
+    schema = {
+        "columns": [[str(column), str(dtype)] for column, dtype in df.dtypes.items()],
+        "index": [str(name) for name in df.index.names] if index else [],
+    }
+
+    md5 = hashlib.md5()
+    md5.update(json.dumps(schema).encode("utf-8"))
+    md5.update(row_hashes.tobytes())
+
+    return md5.hexdigest()
+
+
+def pack(df: pd.DataFrame, max_category_ratio: float = 0.5, quiet: bool = False) -> pd.DataFrame:
+    """Convert the columns of the dataframe to the most compact dtypes that hold the same data.
+
+    Like `owid.repack.repack_frame`, numbers are downcast to the smallest (nullable, if there
+    are missing values) integer or float type, but only when every value survives exactly.
+    Strings are never parsed as numbers, and are only made categorical when they have few
+    distinct values, i.e. at most `max_category_ratio` times the number of rows. Other strings,
+    or columns of mixed types, become nullable strings. Any meaningful index is kept.
+    """
+    memory_before = df.memory_usage(deep=True).sum()
+
+    index_names = list(df.index.names) if has_index(df) else []
+    df = df.reset_index(drop=not index_names)
+
+    df = pd.concat([_pack_series(df[col], max_category_ratio) for col in df.columns], axis=1)
+    if index_names:
+        df = df.set_index(index_names)
+
+    if not quiet:
+        memory_after = df.memory_usage(deep=True).sum()
+        log("PACKED", f"{memory_before / 2**20:.1f}MB -> {memory_after / 2**20:.1f}MB in memory")
+
+    return df
+
+
+def _pack_series(s: pd.Series, max_category_ratio: float) -> pd.Series:
+    if s.dtype.name == "object":
+        # strings like "004" or "1.10" are often codes rather than numbers, so they are never parsed
+        if s.nunique(dropna=True) <= max_category_ratio * len(s):
+            try:
+                return to_category(s)
+            except ValueError:
+                pass
+
+        return s.astype("string")
+
+    if s.dtype.kind != "f":
+        # integers are shrunk exactly, other dtypes are left as they are
+        return repack_series(s)
+
+    for strategy in (to_int, to_float):
+        try:
+            packed = strategy(s)
+        except (ValueError, TypeError):
+            continue
+
+        # repack only checks values approximately, so only keep downcasts that lose nothing
+        if _same_values(packed, s):
+            return packed
+
+    return s
+
+
+def _same_values(packed: pd.Series, original: pd.Series) -> bool:
+    "Whether the packed float series holds exactly the same values, with nulls in the same places."
+    missing = original.isna().to_numpy()
+    if not np.array_equal(packed.isna().to_numpy(), missing):
+        return False
+
+    packed_values = packed.to_numpy(dtype="float64", na_value=np.nan)[~missing]
+    original_values = original.to_numpy(dtype="float64", na_value=np.nan)[~missing]
+
+    return bool(np.array_equal(packed_values, original_values))
+
+
+def to_file(df: pd.DataFrame, filename: str) -> None:
+    "Serialise the dataframe into a file, choosing the format from its extension."
+    dataframes.to_file(df, file_path=filename)
+
+
+def has_index(df: pd.DataFrame) -> bool:
+    return df.index.names[0] is not None
+
+
+def _to_arrow(df: pd.DataFrame, preserve_index: bool):
+    """Convert the dataframe to an arrow table without the pandas and library versions in
+    its metadata, keeping the rest of it so that dtypes and index survive a round-trip."""
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=preserve_index)
+
+    metadata = dict(table.schema.metadata or {})
+    if b"pandas" in metadata:
+        pandas_metadata = json.loads(metadata[b"pandas"])
+        pandas_metadata.pop("pandas_version", None)
+        pandas_metadata.pop("creator", None)
+        metadata[b"pandas"] = json.dumps(pandas_metadata, sort_keys=True).encode("utf-8")
+
+    return table.replace_schema_metadata(metadata)
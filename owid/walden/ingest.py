@@ -1,15 +1,13 @@
 """Tools to ingest to Walden and Catalog."""
 
-import tempfile
 from pathlib import Path
 from typing import Optional, Union
 
 import pandas as pd
-from owid.datautils import dataframes
 
-from owid.walden import files
+from owid.walden import frames, profiling
 
-from .catalog import Dataset
+from .catalog import Catalog, Dataset
 from .ui import log
 
 
@@ -19,10 +17,16 @@ def add_to_catalog(
     dataframe: Optional[pd.DataFrame] = None,
     upload: bool = False,
     public: bool = True,
-) -> None:
+    move: bool = False,
+    canonical: bool = False,
+    skip_unchanged: bool = False,
+    pack: bool = False,
+    compress: bool = False,
+) -> Optional[Dataset]:
     """Add dataset with metadata to catalog, where the data is either a local file, or a dataframe in memory.
 
-    Additionally, it computes the md5 hash of the file, which is added to the metadata file.
+    Additionally, it computes the md5 hash of the file, which is added to the metadata file. For tabular data, a
+    profile of its contents (columns, dtypes, row count, years, countries) is stored next to the data file.
 
     TODO: Add checks of fields.
 
@@ -32,34 +36,61 @@ def add_to_catalog(
         dataframe (pd.DataFrame or None): Dataframe to upload (if filename is not given).
         upload (bool): True to upload data to Walden bucket.
         public (bool): True to make file public.
+        move (bool): True to move the local data file into the cache instead of copying it.
+        canonical (bool): True to serialise the dataframe deterministically (sorted rows, fixed formatting, no
+            library versions in the file metadata), so that unchanged data keeps the same md5 and is not re-uploaded.
+            The fingerprint of the dataframe then ignores the order of its rows.
+        skip_unchanged (bool): True to compare the fingerprint of the dataframe with the one of the latest version in
+            the catalog, and do nothing at all (no serialisation, no upload, no new index file) if they match.
+        pack (bool): True to convert the dataframe to compact dtypes (downcast numbers, categorical low-cardinality
+            strings, nullable dtypes) before storing it, see `frames.pack`.
+        compress (bool): True to store the file zstd-compressed in the Walden bucket, which makes large text files
+            much faster to upload and download. It is decompressed again on download, so the md5 does not change.
+
+    Returns:
+        Dataset or None: The dataset added to the catalog, or None if it was skipped as unchanged.
     """
     if (filename is not None) and (dataframe is None):
         # checksum happens in here, copy to cache happens here
-        dataset = Dataset.copy_and_create(str(filename), metadata)
+        dataset = Dataset.copy_and_create(str(filename), metadata, move=move)
+    elif (dataframe is not None) and (filename is None):
+        if isinstance(metadata, dict):
+            metadata = Dataset.from_dict(metadata)  # type: ignore
 
-        if upload:
-            # add it to our DigitalOcean Space and set `owid_cache_url`
-            dataset.upload(public=public)
+        if pack:
+            dataframe = frames.pack(dataframe)
 
-        # save the JSON to the local index
-        dataset.save()
-        log("ADDED TO CATALOG", f"{dataset.relative_base}.json")
-    elif (dataframe is not None) and (filename is None):
-        # Get output file extension from metadata.
-        if type(metadata) == dict:
-            file_extension = metadata["file_extension"]  # type: ignore
-        else:
-            file_extension = metadata.file_extension  # type: ignore
-
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Save dataframe in a temporary file.
-            # Use the extension specified in the metadata, so that the file is stored in the right format.
-            temp_file = Path(temp_dir) / f"temp.{file_extension}"
-            dataframes.to_file(dataframe, file_path=temp_file)
-            # Add file checksum to metadata.
-            metadata.md5 = files.checksum(temp_file)  # type: ignore
-            # Run the function again, but now fetching the data from the temporary file instead of the dataframe.
-            # This time the function will create the walden index file and upload to s3 (if upload is True).
-            add_to_catalog(metadata=metadata, filename=temp_file, upload=upload, public=public)
+        # Hash the contents of the dataframe, which is much cheaper than writing and checksumming a file.
+        metadata.fingerprint = frames.fingerprint(dataframe, ordered=not canonical)  # type: ignore
+        if skip_unchanged and not _has_changed_fingerprint(metadata):  # type: ignore
+            log("UNCHANGED", f"{metadata.relative_base}")  # type: ignore
+            return None
+
+        # Serialise the dataframe straight into the cache, computing its checksum as it is written.
+        dataset = Dataset.write_and_create(dataframe, metadata, canonical=canonical)
+
+        # Profile the dataframe we already have in memory, instead of reading the file back.
+        if profiling.is_tabular(dataset.file_extension):
+            dataset.add_profile(dataframe)
     else:
         raise ValueError("Use either 'filename' or 'dataframe' argument, but not both.")
+
+    if upload:
+        # add it to our DigitalOcean Space and set `owid_cache_url` (and `owid_profile_url` for tabular data)
+        dataset.upload(public=public, compress=compress)
+
+    # save the JSON to the local index
+    dataset.save()
+    log("ADDED TO CATALOG", f"{dataset.relative_base}.json")
+
+    return dataset
+
+
+def _has_changed_fingerprint(dataset: Dataset) -> bool:
+    "Check if the fingerprint differs from the one of the latest version of the dataset in the catalog."
+    try:
+        dataset_last = Catalog().find_latest(namespace=dataset.namespace, short_name=dataset.short_name)
+    except ValueError:
+        return True
+
+    return dataset_last.fingerprint is None or dataset_last.fingerprint != dataset.fingerprint
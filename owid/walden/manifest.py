@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  manifest.py
+#  walden
+#
+#  A single object in the bucket listing the key, size, md5 and last-modified time of every
+#  Walden file, so that integrity checks and size estimates need one listing and a few GETs
+#  instead of one request per file. Uploads, copies and deletes in `owid_cache` never rewrite
+#  it: each adds a small entry to a journal next to it, so that concurrent changes are never
+#  lost, and `compact` folds the journal into the manifest, which `load` does by itself once
+#  the journal grows past `COMPACT_AFTER` entries.
+#
+#  Every function takes the S3 client to use, see `owid_cache.connect`.
+#
+
+import concurrent.futures
+import datetime as dt
+import json
+import logging
+import os
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import click
+from botocore.exceptions import ClientError
+
+from owid.walden import files, ui
+
+MANIFEST_KEY = "_manifest.json"
+
+# one small object per change since the manifest was last compacted
+JOURNAL_PREFIX = "_manifest/"
+
+# journal entries not yet folded into the manifest beyond which `load` compacts it
+COMPACT_AFTER = int(os.environ.get("WALDEN_MANIFEST_COMPACT_AFTER", 100))
+
+# compacting only folds journal entries older than COMPACT_MIN_AGE, so that none written before
+# them can still be in flight, and only deletes folded entries older than JOURNAL_RETENTION, so
+# that another process compacting at the same time cannot overwrite them with an older manifest
+COMPACT_MIN_AGE = dt.timedelta(hours=1)
+JOURNAL_RETENTION = dt.timedelta(days=1)
+
+# format of the timestamp that starts every journal key
+_TIMESTAMP = "%Y%m%dT%H%M%S%fZ"
+
+# requests in flight at once when reading the journal or rebuilding
+MAX_REQUESTS = 16
+
+Manifest = Dict[str, Dict[str, Any]]
+
+
+def load(client) -> Manifest:
+    """
+    Fetch the manifest from the bucket, with the changes journaled since it was compacted,
+    compacting it first if more than `COMPACT_AFTER` changes were journaled.
+    """
+    manifest, journal_through, journal = _read(client)
+    pending = _pending(journal, journal_through)
+    if len(pending) > COMPACT_AFTER:
+        return _compact(client, manifest, journal_through, journal)
+
+    _apply_all(manifest, _get_changes(client, pending))
+    return manifest
+
+
+def save(client, manifest: Manifest, journal_through: Optional[str] = None) -> None:
+    "Store the manifest, with the key of the last journal entry already folded into it."
+    body = json.dumps({"files": manifest, "journal_through": journal_through}, indent=2, sort_keys=True)
+    client.put_object(Bucket="walden", Key=MANIFEST_KEY, Body=body.encode("utf-8"), ContentType="application/json")
+
+
+def record(client, key: str, size: Optional[int], md5: Optional[str]) -> None:
+    "Add or replace the entry for an object that was just written."
+    _journal(client, {"key": key, **_entry(size, md5)})
+
+
+def record_copy(client, source_key: str, key: str, md5: Optional[str]) -> None:
+    "Add the entry for an object copied from another one, reusing what we know about the source."
+    _journal(client, {"key": key, "copy_of": source_key, **_entry(None, md5)})
+
+
+def remove(client, keys: Iterable[str]) -> None:
+    "Remove the entries of objects that were just deleted."
+    _journal(client, {"removed": list(keys)})
+
+
+def compact(client) -> Manifest:
+    """
+    Fold the journal into the manifest, and delete the journal entries that were folded in long
+    enough ago (see `COMPACT_MIN_AGE` and `JOURNAL_RETENTION`). Return the up-to-date manifest.
+    """
+    manifest, journal_through, journal = _read(client)
+    return _compact(client, manifest, journal_through, journal)
+
+
+def rebuild(client) -> Manifest:
+    """
+    Build the manifest from scratch by listing the whole bucket, with a HEAD request per object
+    for the md5 we store in its metadata. Only objects without a transport compression fall back
+    to their ETag, since that of a compressed object is the md5 of its compressed bytes.
+    """
+    # the listing below already covers every change journaled before it
+    journal = [obj["Key"] for obj in _list(client, JOURNAL_PREFIX)]
+
+    objects = [obj for obj in _list(client) if obj["Key"] != MANIFEST_KEY and not obj["Key"].startswith(JOURNAL_PREFIX)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_REQUESTS) as executor:
+        heads = list(executor.map(lambda obj: _head(client, obj["Key"]), objects))
+
+    manifest: Manifest = {}
+    for obj, head in zip(objects, heads):
+        key = obj["Key"]
+        md5 = (head or {}).get("Metadata", {}).get("md5")
+        if md5 is None and not _is_compressed(key):
+            etag = obj.get("ETag", "").strip('"')
+            md5 = etag if etag and "-" not in etag else None
+
+        manifest[key] = {
+            "size": obj["Size"],
+            "md5": md5,
+            "last_modified": obj["LastModified"].isoformat(),
+        }
+
+    save(client, manifest, journal_through=max(journal, default=None))
+    _delete(client, journal)
+    return manifest
+
+
+def check(manifest: Manifest, objects: Iterable[Tuple[str, Optional[str]]]) -> List[str]:
+    "Compare the key and md5 of every catalog entry with the manifest and describe every missing or mismatched file."
+    problems = []
+    for key, md5 in objects:
+        entry = manifest.get(key)
+        if entry is None:
+            problems.append(f"missing: {key}")
+        elif entry.get("md5") and md5 and entry["md5"] != md5:
+            problems.append(f"md5 mismatch: {key} (index {md5}, bucket {entry['md5']})")
+
+    return problems
+
+
+def _read(client) -> Tuple[Manifest, Optional[str], List[str]]:
+    "The manifest as last saved, the last journal entry folded into it, and the whole journal."
+    try:
+        resp = client.get_object(Bucket="walden", Key=MANIFEST_KEY)
+        doc = json.loads(resp["Body"].read())
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey"):
+            raise
+        doc = {"files": {}}
+
+    # journal keys sort in the order the changes were made
+    journal = sorted(obj["Key"] for obj in _list(client, JOURNAL_PREFIX))
+
+    return doc["files"], doc.get("journal_through"), journal
+
+
+def _compact(client, manifest: Manifest, journal_through: Optional[str], journal: List[str]) -> Manifest:
+    now = dt.datetime.now(dt.timezone.utc)
+    pending = _pending(journal, journal_through)
+    changes = _get_changes(client, pending)
+
+    settled = [key for key in pending if _is_older(key, now - COMPACT_MIN_AGE)]
+    _apply_all(manifest, changes[: len(settled)])
+    if settled:
+        journal_through = settled[-1]
+        save(client, manifest, journal_through=journal_through)
+
+    _delete(client, [key for key in _folded(journal, journal_through) if _is_older(key, now - JOURNAL_RETENTION)])
+
+    _apply_all(manifest, changes[len(settled) :])
+    return manifest
+
+
+def _pending(journal: List[str], journal_through: Optional[str]) -> List[str]:
+    return [key for key in journal if journal_through is None or key > journal_through]
+
+
+def _folded(journal: List[str], journal_through: Optional[str]) -> List[str]:
+    return [key for key in journal if journal_through is not None and key <= journal_through]
+
+
+def _is_older(key: str, cutoff: dt.datetime) -> bool:
+    timestamp = key[len(JOURNAL_PREFIX) :].split("-", 1)[0]
+    return timestamp <= cutoff.strftime(_TIMESTAMP)
+
+
+def _get_changes(client, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_REQUESTS) as executor:
+        return list(executor.map(lambda key: _get_json(client, key), keys))
+
+
+def _apply_all(manifest: Manifest, changes: List[Optional[Dict[str, Any]]]) -> None:
+    for change in changes:
+        if change is not None:
+            _apply(manifest, change)
+
+
+def _apply(manifest: Manifest, change: Dict[str, Any]) -> None:
+    if "removed" in change:
+        for key in change["removed"]:
+            manifest.pop(key, None)
+        return
+
+    entry = {field: change[field] for field in ("size", "md5", "last_modified")}
+    if "copy_of" in change:
+        entry["size"] = manifest.get(change["copy_of"], {}).get("size")
+    manifest[change["key"]] = entry
+
+
+def _journal(client, change: Dict[str, Any]) -> None:
+    """
+    Add the change to the journal, under a new key so that it never overwrites another one. A
+    failure here should never fail the transfer it records, since `rebuild` can always bring
+    the manifest up to date again.
+    """
+    timestamp = dt.datetime.now(dt.timezone.utc).strftime(_TIMESTAMP)
+    key = f"{JOURNAL_PREFIX}{timestamp}-{uuid.uuid4().hex}.json"
+    try:
+        client.put_object(Bucket="walden", Key=key, Body=json.dumps(change).encode("utf-8"))
+    except ClientError as e:
+        logging.warning(f"could not update the manifest: {e}")
+
+
+def _get_json(client, key: str) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(client.get_object(Bucket="walden", Key=key)["Body"].read())
+    except ClientError as e:
+        # compacted away since we listed it
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+            return None
+        raise
+
+
+def _head(client, key: str) -> Optional[Dict[str, Any]]:
+    try:
+        return client.head_object(Bucket="walden", Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+
+def _list(client, prefix: str = "") -> Iterator[Dict[str, Any]]:
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket="walden", Prefix=prefix):
+        yield from page.get("Contents", [])
+
+
+def _delete(client, keys: List[str]) -> None:
+    for i in range(0, len(keys), files.DELETE_BATCH_SIZE):
+        batch = keys[i : i + files.DELETE_BATCH_SIZE]
+        resp = client.delete_objects(
+            Bucket="walden", Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+        )
+        if resp.get("Errors"):
+            raise JournalError(resp["Errors"])
+
+
+def _is_compressed(key: str) -> bool:
+    return key.endswith(tuple("." + extension for extension in files.COMPRESSIONS.values()))
+
+
+def _entry(size: Optional[int], md5: Optional[str]) -> Dict[str, Any]:
+    return {
+        "size": size,
+        "md5": md5,
+        "last_modified": dt.datetime.now(dt.timezone.utc).isoformat(),
+    }
+
+
+@click.command()
+@click.option("--rebuild", "rebuild_", is_flag=True, help="Rebuild the manifest by listing the whole bucket")
+@click.option("--compact", "compact_", is_flag=True, help="Fold the journal of recent changes into the manifest")
+def main(rebuild_: bool = False, compact_: bool = False) -> None:
+    "Check every catalog entry against the manifest of the bucket."
+    from owid.walden import Catalog, owid_cache
+
+    client = owid_cache.connect()
+    if rebuild_:
+        manifest = rebuild(client)
+    elif compact_:
+        manifest = compact(client)
+    else:
+        manifest = load(client)
+
+    objects = []
+    for dataset in Catalog():
+        if dataset.owid_data_url:
+            bucket, key = owid_cache.s3_bucket_key(dataset.owid_data_url)
+            if bucket == "walden":
+                objects.append((key, dataset.md5))
+
+    problems = check(manifest, objects)
+    for problem in problems:
+        ui.log("PROBLEM", problem)
+
+    total = sum(entry.get("size") or 0 for entry in manifest.values())
+    print(f"{len(manifest)} files in the bucket, {total / 2**30:.1f}GB, {len(problems)} problems")
+
+
+class JournalError(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    main()
@@ -7,15 +7,22 @@
 import logging
 import os
 import re
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from os import path
-from typing import Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 from owid.walden.ui import bail, log
 
+from . import files, manifest
 from .files import ChecksumDoesNotMatch, checksum
 
 SPACES_ENDPOINT = "https://nyc3.digitaloceanspaces.com"
@@ -23,31 +30,298 @@ S3_BASE = "s3://walden.nyc3.digitaloceanspaces.com"
 HTTPS_BASE = "https://walden.nyc3.digitaloceanspaces.com"
 AWS_PROFILE = os.environ.get("AWS_PROFILE", "default")
 
+# multipart transfer settings, tuned for multi-GB snapshots; override them with these
+# environment variables or with arguments to `upload` and `download`
+MULTIPART_CHUNKSIZE = int(os.environ.get("WALDEN_MULTIPART_CHUNKSIZE_MB", 64)) * 2**20
+MAX_CONCURRENCY = int(os.environ.get("WALDEN_MAX_CONCURRENCY", 16))
+USE_THREADS = os.environ.get("WALDEN_USE_THREADS", "1").lower() not in ("0", "false", "no")
 
-def upload(filename: str, relative_path: str, public: bool = False) -> str:
+# smallest size S3 accepts for every part of a multipart upload but the last
+MIN_PART_SIZE = 5 * 2**20
+
+# number of parts held in memory and uploaded at once when streaming, see `StreamingUpload`
+STREAMING_MAX_IN_FLIGHT = int(os.environ.get("WALDEN_STREAMING_MAX_IN_FLIGHT", 4))
+
+# seconds for which presigned URLs to private objects are valid
+PRESIGNED_URL_EXPIRY = 3600
+
+# S3 clients by (profile, endpoint), see `connect()`
+_clients: Dict[Tuple[str, str], Any] = {}
+_clients_lock = threading.Lock()
+
+
+def upload(
+    filename: str,
+    relative_path: str,
+    public: bool = False,
+    multipart_chunksize: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+    use_threads: Optional[bool] = None,
+    md5: Optional[str] = None,
+) -> str:
     """
-    Upload file to Walden.
+    Upload file to Walden. If its md5 is given, it is stored with the object and the upload
+    is skipped when the object already exists with the same content.
 
     Args:
         local_path (str): Local path to file.
         walden_path (str): Path where to store the file in Walden.
         public (bool): Set to True to expose the file to the public (read only). Defaults to False.
+        multipart_chunksize (int): Size in bytes of each part of multipart uploads. Defaults to MULTIPART_CHUNKSIZE.
+        max_concurrency (int): Number of parts to upload at once. Defaults to MAX_CONCURRENCY.
+        use_threads (bool): Set to False to upload parts one at a time in this thread. Defaults to USE_THREADS.
+        md5 (str): Checksum of the file, to skip uploading content that is already there.
     """
     dest_path = f"{S3_BASE}/{relative_path}"
-    extra_args = {"ACL": "public-read"} if public else {}
+    extra_args: Dict[str, Any] = {"ACL": "public-read"} if public else {}
+    config = transfer_config(multipart_chunksize, max_concurrency, use_threads)
 
     client = connect()
+
+    if md5:
+        if remote_md5("walden", relative_path) == md5:
+            if public:
+                # the content is there, but make sure it is readable
+                client.put_object_acl(Bucket="walden", Key=relative_path, ACL="public-read")
+            log("UNCHANGED", f"{filename} -> {dest_path}")
+            return f"{HTTPS_BASE}/{relative_path}"
+
+        extra_args["Metadata"] = {"md5": md5}
+
+    start = time.time()
     try:
-        client.upload_file(filename, "walden", relative_path, ExtraArgs=extra_args)
+        client.upload_file(filename, "walden", relative_path, ExtraArgs=extra_args, Config=config)
     except ClientError as e:
         logging.error(e)
         raise UploadError(e)
 
-    log("UPLOADED", f"{filename} -> {dest_path}")
+    log("UPLOADED", f"{filename} -> {dest_path} {_throughput(filename, start)}")
+
+    manifest.record(client, relative_path, size=path.getsize(filename), md5=md5)
 
     return f"{HTTPS_BASE}/{relative_path}"
 
 
+def copy(
+    source_url: str,
+    relative_path: str,
+    public: bool = False,
+    md5: Optional[str] = None,
+) -> str:
+    """
+    Copy an object that is already in Walden to a new path, server-side, so that its content
+    does not need to be uploaded again.
+
+    Args:
+        source_url (str): URL of the existing object in Walden.
+        relative_path (str): Path where to store the copy in Walden.
+        public (bool): Set to True to expose the copy to the public (read only). Defaults to False.
+        md5 (str): Checksum of the content, stored with the copy.
+    """
+    dest_path = f"{S3_BASE}/{relative_path}"
+    bucket, key = s3_bucket_key(source_url)
+
+    client = connect()
+
+    if md5 and remote_md5("walden", relative_path) == md5:
+        if public:
+            client.put_object_acl(Bucket="walden", Key=relative_path, ACL="public-read")
+        log("UNCHANGED", f"{source_url} -> {dest_path}")
+        return f"{HTTPS_BASE}/{relative_path}"
+
+    extra_args: Dict[str, Any] = {"ACL": "public-read"} if public else {}
+    if md5:
+        extra_args["Metadata"] = {"md5": md5}
+        extra_args["MetadataDirective"] = "REPLACE"
+
+    try:
+        # the managed copy falls back to a multipart copy for objects over 5GB
+        client.copy(
+            {"Bucket": bucket, "Key": key}, "walden", relative_path, ExtraArgs=extra_args, Config=transfer_config()
+        )
+    except ClientError as e:
+        logging.error(e)
+        raise UploadError(e)
+
+    log("COPIED", f"{source_url} -> {dest_path}")
+
+    manifest.record_copy(client, key, relative_path, md5=md5)
+
+    return f"{HTTPS_BASE}/{relative_path}"
+
+
+class StreamingUpload:
+    """
+    Upload a stream of bytes of unknown length to Walden as it is being written, in parts of
+    `part_size` bytes, at least `MIN_PART_SIZE`, so that it can be fed straight from a
+    download. At most `max_in_flight` parts are held in memory and uploaded at once.
+
+    Call `complete(md5)` once everything has been written, or `abort()` on failure. If the md5
+    is known in advance, pass it here so that it is stored with the object when the upload is
+    created; otherwise it is only stored for uploads that fit in a single part.
+    """
+
+    def __init__(
+        self,
+        relative_path: str,
+        public: bool = False,
+        part_size: Optional[int] = None,
+        max_in_flight: int = STREAMING_MAX_IN_FLIGHT,
+        md5: Optional[str] = None,
+    ):
+        self.relative_path = relative_path
+        self.public = public
+        self.md5 = md5
+        self.part_size = part_size or MULTIPART_CHUNKSIZE
+        self.size = 0
+
+        if self.part_size < MIN_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes, got {self.part_size}")
+
+        self._client = connect()
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: List[Future] = []
+        self._max_in_flight = max_in_flight
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._start = time.time()
+
+    def write(self, b) -> int:
+        self._buffer += b
+        self.size += len(b)
+        if len(self._buffer) >= self.part_size:
+            self._send_part()
+        return len(b)
+
+    def complete(self, md5: str) -> str:
+        "Finish the upload and return its URL, after checking the md5 if it was given in advance."
+        try:
+            if self.md5 and md5 != self.md5:
+                raise ChecksumDoesNotMatch(f"for stream uploaded to {S3_BASE}/{self.relative_path}")
+
+            if self._upload_id is None:
+                # it all fit in a single part
+                self._client.put_object(
+                    Bucket="walden",
+                    Key=self.relative_path,
+                    Body=bytes(self._buffer),
+                    **self._extra_args(md5),
+                )
+            else:
+                if self._buffer:
+                    self._send_part()
+                parts = [future.result() for future in self._parts]
+                self._client.complete_multipart_upload(
+                    Bucket="walden",
+                    Key=self.relative_path,
+                    UploadId=self._upload_id,
+                    MultipartUpload={"Parts": parts},
+                )
+        except BaseException as e:
+            self.abort()
+            if isinstance(e, ClientError):
+                logging.error(e)
+                raise UploadError(e)
+            raise
+        finally:
+            self._executor.shutdown()
+
+        elapsed = max(time.time() - self._start, 1e-6)
+        size = self.size / 2**20
+        log(
+            "UPLOADED",
+            f"stream -> {S3_BASE}/{self.relative_path} ({size:.1f}MB in {elapsed:.1f}s, {size / elapsed:.1f}MB/s)",
+        )
+
+        manifest.record(self._client, self.relative_path, size=self.size, md5=md5)
+
+        return f"{HTTPS_BASE}/{self.relative_path}"
+
+    def abort(self) -> None:
+        if self._upload_id is not None:
+            for future in self._parts:
+                future.cancel()
+            self._client.abort_multipart_upload(Bucket="walden", Key=self.relative_path, UploadId=self._upload_id)
+            self._upload_id = None
+        self._executor.shutdown()
+
+    def _send_part(self) -> None:
+        if self._upload_id is None:
+            resp = self._client.create_multipart_upload(
+                Bucket="walden", Key=self.relative_path, **self._extra_args(self.md5)
+            )
+            self._upload_id = resp["UploadId"]
+
+        # bound the memory used by parts waiting to be uploaded
+        in_flight = [future for future in self._parts if not future.done()]
+        if len(in_flight) >= self._max_in_flight:
+            in_flight[0].result()
+
+        part_number = len(self._parts) + 1
+        body = bytes(self._buffer)
+        self._buffer = bytearray()
+        self._parts.append(self._executor.submit(self._upload_part, part_number, body))
+
+    def _extra_args(self, md5: Optional[str]) -> Dict[str, Any]:
+        extra_args: Dict[str, Any] = {"ACL": "public-read"} if self.public else {}
+        if md5:
+            extra_args["Metadata"] = {"md5": md5}
+        return extra_args
+
+    def _upload_part(self, part_number: int, body: bytes) -> Dict[str, Any]:
+        resp = self._client.upload_part(
+            Bucket="walden", Key=self.relative_path, UploadId=self._upload_id, PartNumber=part_number, Body=body
+        )
+        return {"ETag": resp["ETag"], "PartNumber": part_number}
+
+
+def exists(relative_path: str) -> bool:
+    "Check whether an object exists in Walden, without downloading it."
+    try:
+        connect().head_object(Bucket="walden", Key=relative_path)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+    return True
+
+
+def remote_md5(bucket: str, key: str) -> Optional[str]:
+    """
+    Return the md5 of an object in the bucket without downloading it, or None if it does not
+    exist or we cannot tell. It is read from the metadata we store on upload, or otherwise from
+    the ETag, which is the md5 for objects that were not uploaded in multiple parts.
+    """
+    head = head_object(bucket, key)
+    if head is None:
+        return None
+
+    return md5_from_head(head)
+
+
+def head_object(bucket: str, key: str) -> Optional[Dict[str, Any]]:
+    "Return the size, ETag and metadata of an object without downloading it, or None if it does not exist."
+    try:
+        return connect().head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+
+def md5_from_head(head: Dict[str, Any]) -> Optional[str]:
+    "The md5 of an object given the response to a HEAD request on it, see `remote_md5`."
+    if "md5" in head.get("Metadata", {}):
+        return head["Metadata"]["md5"]
+
+    etag = head.get("ETag", "").strip('"')
+    if etag and "-" not in etag:
+        return etag
+
+    return None
+
+
 def delete(relative_path: str, quiet: bool = False):
     """Delete object at given S3 URL."""
     s3_url = f"{S3_BASE}/{relative_path}"
@@ -62,16 +336,59 @@ def delete(relative_path: str, quiet: bool = False):
         logging.error(e)
         raise DeleteError(e)
 
+    manifest.remove(client, [key])
+
     if not quiet:
         log("DELETED", f"{s3_url}")
 
 
+def delete_many(relative_paths: List[str], quiet: bool = False) -> None:
+    """Delete many objects in Walden, in batches of up to 1000 keys per request."""
+    client = connect()
+
+    for i in range(0, len(relative_paths), files.DELETE_BATCH_SIZE):
+        batch = relative_paths[i : i + files.DELETE_BATCH_SIZE]
+        try:
+            resp = client.delete_objects(
+                Bucket="walden",
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+        except ClientError as e:
+            logging.error(e)
+            raise DeleteError(e)
+
+        if resp.get("Errors"):
+            raise DeleteError(resp["Errors"])
+
+        manifest.remove(client, batch)
+
+        if not quiet:
+            for key in batch:
+                log("DELETED", f"{S3_BASE}/{key}")
+
+
+def list_objects(prefix: str = "") -> Iterator[Dict[str, Any]]:
+    """List all objects in Walden under the given prefix, following pagination."""
+    client = connect()
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket="walden", Prefix=prefix):
+        yield from page.get("Contents", [])
+
+
 def s3_bucket_key(url: str) -> Tuple[str, str]:
-    """Get bucket and key from either s3:// URL or https:// URL."""
+    """
+    Get bucket and key from either s3:// URL or https:// URL, with the bucket in the host
+    (e.g. https://walden.nyc3.digitaloceanspaces.com/a/test.csv) or path-style, with the
+    bucket as the first part of the path (e.g. https://nyc3.digitaloceanspaces.com/walden/a/test.csv).
+    """
     parsed = urlparse(url)
     bucket = parsed.netloc
     key = parsed.path.lstrip("/")
 
+    # path-style URL on the region endpoint itself
+    if re.fullmatch(r"\w+\.digitaloceanspaces\.com", bucket):
+        bucket, _, key = key.partition("/")
+
     # strip region from bucket name for digitalocean spaces
     bucket = re.sub(r"\.\w+\.digitaloceanspaces\.com", "", bucket)
 
@@ -81,36 +398,116 @@ def s3_bucket_key(url: str) -> Tuple[str, str]:
     return bucket, key
 
 
-def download(s3_url: str, filename: str, expected_md5: Optional[str] = None, quiet: bool = False) -> None:
-    """Download the file at the S3 URL to the given local filename."""
+def download(
+    s3_url: str,
+    filename: str,
+    expected_md5: Optional[str] = None,
+    quiet: bool = False,
+    multipart_chunksize: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+    use_threads: Optional[bool] = None,
+    presigned: bool = True,
+    decompress: Optional[str] = None,
+) -> None:
+    """
+    Download the file at the S3 URL to the given local filename.
+
+    By default this goes through a short-lived presigned URL and `files.download`, the same
+    pooled, resumable HTTP path used for public files, which checksums the file as it arrives.
+    Set `presigned` to False to use boto3's multipart download instead. Pass `decompress` if
+    the object was stored compressed, see `files.COMPRESSIONS`.
+    """
+    if presigned:
+        files.download(presigned_url(s3_url), filename, expected_md5=expected_md5, quiet=True, decompress=decompress)
+        if not quiet:
+            log("DOWNLOADED", f"{s3_url} -> {filename}")
+        return
+
     client = connect()
 
     bucket, key = s3_bucket_key(s3_url)
+    config = transfer_config(multipart_chunksize, max_concurrency, use_threads)
 
+    start = time.time()
     try:
-        client.download_file(bucket, key, filename)
+        client.download_file(bucket, key, filename + ".tmp" if decompress else filename, Config=config)
     except ClientError as e:
         logging.error(e)
         raise UploadError(e)
 
+    if decompress:
+        with open(filename + ".tmp", "rb") as istream, open(filename, "wb") as ostream:
+            with files.decompressing_writer(ostream, decompress) as writer:
+                shutil.copyfileobj(istream, writer)
+        os.remove(filename + ".tmp")
+
     if expected_md5:
         if checksum(filename) != expected_md5:
             os.remove(filename)
             raise ChecksumDoesNotMatch(f"for file downloaded from {s3_url}")
 
     if not quiet:
-        log("DOWNLOADED", f"{s3_url} -> {filename}")
+        log("DOWNLOADED", f"{s3_url} -> {filename} {_throughput(filename, start)}")
 
 
-def connect():
-    "Return a connection to Walden's DigitalOcean space."
-    check_for_default_profile()
+def presigned_url(s3_url: str, expires_in: int = PRESIGNED_URL_EXPIRY) -> str:
+    "Return a URL that grants anyone read access to a (private) object for `expires_in` seconds."
+    bucket, key = s3_bucket_key(s3_url)
+    return connect().generate_presigned_url(
+        "get_object",
+        Params={"Bucket": bucket, "Key": key},
+        ExpiresIn=expires_in,
+    )
+
 
-    session = boto3.Session(profile_name=AWS_PROFILE)
-    client = session.client(
-        service_name="s3",
-        endpoint_url=SPACES_ENDPOINT,
+def transfer_config(
+    multipart_chunksize: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+    use_threads: Optional[bool] = None,
+) -> TransferConfig:
+    "Return the settings for multipart transfers, using the module defaults for anything not given."
+    chunksize = multipart_chunksize or MULTIPART_CHUNKSIZE
+    return TransferConfig(
+        multipart_threshold=chunksize,
+        multipart_chunksize=chunksize,
+        max_concurrency=max_concurrency or MAX_CONCURRENCY,
+        use_threads=USE_THREADS if use_threads is None else use_threads,
     )
+
+
+def _throughput(filename: str, start: float) -> str:
+    if not path.exists(filename):
+        return ""
+
+    size = path.getsize(filename) / 2**20
+    elapsed = max(time.time() - start, 1e-6)
+    return f"({size:.1f}MB in {elapsed:.1f}s, {size / elapsed:.1f}MB/s)"
+
+
+def connect():
+    """
+    Return a connection to Walden's DigitalOcean space. Clients are created lazily and
+    reused, one per profile and endpoint, so that repeated transfers keep their connection
+    pool. boto3 clients are thread-safe once created.
+    """
+    key = (AWS_PROFILE, SPACES_ENDPOINT)
+
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                check_for_default_profile()
+
+                session = boto3.Session(profile_name=AWS_PROFILE)
+                client = session.client(
+                    service_name="s3",
+                    endpoint_url=SPACES_ENDPOINT,
+                    # one connection per concurrent transfer thread, instead of botocore's default of 10
+                    config=Config(max_pool_connections=MAX_CONCURRENCY),
+                )
+                _clients[key] = client
+
     return client
 
 
@@ -0,0 +1,146 @@
+#
+#  profiling.py
+#
+#  Lightweight statistics about tabular snapshots, stored as a sidecar next to the data
+#  so that the contents of a dataset can be inspected without downloading it.
+#
+
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from . import files
+
+# file extensions we know how to read into a dataframe
+TABULAR_EXTENSIONS = ("csv", "feather", "parquet")
+
+# column names (lower-cased) that we recognise as holding years and countries
+YEAR_COLUMNS = ("year",)
+COUNTRY_COLUMNS = ("country", "entity", "location", "country_name", "area")
+
+# rows of a CSV file profiled at a time, so that large files are never loaded whole
+CSV_CHUNK_ROWS = 100_000
+
+
+def is_tabular(file_extension: str) -> bool:
+    return file_extension.lower() in TABULAR_EXTENSIONS
+
+
+def read_frame(filename: str, file_extension: str) -> pd.DataFrame:
+    "Read a tabular snapshot into a dataframe."
+    file_extension = file_extension.lower()
+    if file_extension == "csv":
+        return pd.read_csv(filename, encoding_errors="replace")
+    elif file_extension == "feather":
+        return pd.read_feather(filename)
+    elif file_extension == "parquet":
+        return pd.read_parquet(filename)
+
+    raise ValueError(f"cannot profile files with extension {file_extension}")
+
+
+def profile_frame(df: pd.DataFrame, md5: Optional[str] = None) -> Dict[str, Any]:
+    """Summarise a dataframe: its columns, dtypes, row count and, where we can find them,
+    the range of years and the distinct countries it covers.
+
+    All statistics are computed with vectorised operations on the whole frame.
+    """
+    # treat a meaningful index (e.g. country, year) as ordinary columns
+    if any(name is not None for name in df.index.names):
+        df = df.reset_index()
+
+    n_null = df.isnull().sum()
+    profile: Dict[str, Any] = {
+        "md5": md5,
+        "n_rows": int(len(df)),
+        "n_columns": int(len(df.columns)),
+        "columns": [
+            {"name": str(column), "dtype": str(dtype), "n_null": int(n_null[column])}
+            for column, dtype in df.dtypes.items()
+        ],
+    }
+
+    year_column = _find_column(df, YEAR_COLUMNS)
+    if year_column is not None:
+        years = pd.to_numeric(df[year_column], errors="coerce")
+        if years.notnull().any():
+            profile["year_min"] = int(years.min())
+            profile["year_max"] = int(years.max())
+
+    country_column = _find_column(df, COUNTRY_COLUMNS)
+    if country_column is not None:
+        countries = sorted(str(c) for c in df[country_column].dropna().unique())
+        profile["n_countries"] = len(countries)
+        profile["countries"] = countries
+
+    return profile
+
+
+def profile_file(filename: str, file_extension: str, md5: Optional[str] = None) -> Dict[str, Any]:
+    """Profile a tabular file. CSV files are read in chunks of `CSV_CHUNK_ROWS` rows whose
+    profiles are merged, and bytes that are not valid UTF-8 are replaced rather than failing.
+    """
+    if file_extension.lower() != "csv":
+        return profile_frame(read_frame(filename, file_extension), md5=md5)
+
+    profile: Optional[Dict[str, Any]] = None
+    with pd.read_csv(filename, chunksize=CSV_CHUNK_ROWS, encoding_errors="replace") as chunks:
+        for chunk in chunks:
+            chunk_profile = profile_frame(chunk, md5=md5)
+            profile = chunk_profile if profile is None else _merge(profile, chunk_profile)
+
+    return profile if profile is not None else profile_frame(pd.DataFrame(), md5=md5)
+
+
+def save(profile: Dict[str, Any], filename: str) -> None:
+    with open(filename, "w") as ostream:
+        ostream.write(files.json_dumps(profile, indent=2))
+
+
+def load(filename: str) -> Dict[str, Any]:
+    return files.load_json(filename)
+
+
+def _merge(profile: Dict[str, Any], other: Dict[str, Any]) -> Dict[str, Any]:
+    "Combine the profiles of two consecutive chunks of the same file."
+    merged = dict(profile)
+    merged["n_rows"] = profile["n_rows"] + other["n_rows"]
+    merged["columns"] = [
+        {
+            "name": column["name"],
+            "dtype": _common_dtype(column["dtype"], other_column["dtype"]),
+            "n_null": column["n_null"] + other_column["n_null"],
+        }
+        for column, other_column in zip(profile["columns"], other["columns"])
+    ]
+
+    if "year_min" in other:
+        merged["year_min"] = min(profile.get("year_min", other["year_min"]), other["year_min"])
+        merged["year_max"] = max(profile.get("year_max", other["year_max"]), other["year_max"])
+
+    if "countries" in other:
+        countries = sorted(set(profile.get("countries", [])) | set(other["countries"]))
+        merged["n_countries"] = len(countries)
+        merged["countries"] = countries
+
+    return merged
+
+
+def _common_dtype(dtype: str, other: str) -> str:
+    "The dtype pandas would infer for a column whose chunks were inferred as `dtype` and `other`."
+    if dtype == other:
+        return dtype
+
+    try:
+        return str(np.result_type(np.dtype(dtype), np.dtype(other)))
+    except TypeError:
+        return "object"
+
+
+def _find_column(df: pd.DataFrame, candidates: tuple) -> Optional[str]:
+    for column in df.columns:
+        if str(column).lower() in candidates:
+            return column
+
+    return None
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  remote_gc.py
+#  walden
+#
+
+import datetime as dt
+import os
+import subprocess
+from typing import Dict, List, Optional, Set, Tuple
+
+import click
+
+from owid.walden import Catalog, bundles, catalog, manifest, owid_cache, ui
+
+# objects under these prefixes are managed outside of this index, never touch them
+EXCLUDED_PREFIXES = ("backport/", manifest.MANIFEST_KEY, manifest.JOURNAL_PREFIX, bundles.REMOTE_BUNDLE_KEY)
+
+# objects newer than this may belong to an ingest whose index entry is not merged yet
+GRACE_DAYS = int(os.environ.get("WALDEN_GC_GRACE_DAYS", 30))
+
+
+@click.command()
+@click.option("--delete", is_flag=True, help="Actually delete orphaned objects, instead of only reporting them")
+@click.option("--grace-days", type=int, default=GRACE_DAYS, show_default=True, help="Never touch newer objects")
+def remote_gc(delete: bool = False, grace_days: int = GRACE_DAYS) -> None:
+    """
+    Find objects in the Walden bucket that no catalog entry references, and optionally
+    delete them. By default this is a dry run that reports how much space could be reclaimed.
+    Deleting requires the index to be a clean checkout of an up-to-date origin/master.
+    """
+    if delete:
+        check_index_is_current()
+
+    index = Catalog()
+    orphans = find_orphans(referenced_keys(index), owid_cache.list_objects(), grace_days=grace_days)
+
+    # as a last safeguard, keep anything an index entry mentions, even in a form we do not parse
+    orphans = [(key, size) for key, size in orphans if not _is_mentioned(key, index)]
+
+    for key, size in orphans:
+        ui.log("ORPHAN", f"{key} ({size / 2**20:.1f}MB)")
+
+    total = sum(size for _, size in orphans)
+    print(f"{len(orphans)} orphaned objects, {total / 2**20:.1f}MB reclaimable")
+
+    if delete and orphans:
+        owid_cache.delete_many([key for key, _ in orphans])
+
+
+def check_index_is_current() -> None:
+    """
+    Bail unless the index is a clean checkout of origin/master as it is now, since any dataset
+    missing from it, e.g. on a stale or feature branch, would have its objects deleted.
+    """
+    if catalog.BUNDLE_DIR:
+        ui.bail("refusing to delete with an index bundle, use a checkout of origin/master")
+
+    _git("fetch", "--quiet", "origin", "master")
+    if _git("rev-parse", "HEAD") != _git("rev-parse", "origin/master"):
+        ui.bail("refusing to delete, the index is not at origin/master")
+
+    if _git("status", "--porcelain", "--", catalog.INDEX_DIR):
+        ui.bail("refusing to delete, the index has local changes")
+
+
+def referenced_keys(index: Catalog) -> Set[str]:
+    """
+    Keys in the Walden bucket of every URL in the catalog, whatever the field and whatever
+    the form of the URL, so that nothing an index entry mentions is ever taken for an orphan.
+    """
+    keys = set()
+    for dataset in index:
+        for value in dataset.metadata.values():
+            if isinstance(value, str) and "://" in value:
+                bucket, key = owid_cache.s3_bucket_key(value)
+                if bucket == "walden" and key:
+                    keys.add(key)
+
+    return keys
+
+
+def find_orphans(
+    referenced: Set[str], objects, grace_days: int = GRACE_DAYS, now: Optional[dt.datetime] = None
+) -> List[Tuple[str, int]]:
+    "Return the key and size of each listed object that is not referenced and is older than `grace_days`."
+    cutoff = (now or dt.datetime.now(dt.timezone.utc)) - dt.timedelta(days=grace_days)
+
+    orphans: Dict[str, int] = {}
+    for obj in objects:
+        key = obj["Key"]
+        if key not in referenced and not key.startswith(EXCLUDED_PREFIXES) and obj["LastModified"] < cutoff:
+            orphans[key] = obj["Size"]
+
+    return sorted(orphans.items())
+
+
+def _is_mentioned(key: str, index: Catalog) -> bool:
+    for dataset in index:
+        for value in dataset.metadata.values():
+            if isinstance(value, str) and value.endswith(f"/{key}"):
+                ui.log("KEEP", f"{key} is mentioned by {dataset.namespace}/{dataset.version}/{dataset.short_name}")
+                return True
+
+    return False
+
+
+def _git(*args: str) -> str:
+    return subprocess.run(["git", *args], cwd=catalog.BASE_DIR, check=True, capture_output=True, text=True).stdout
+
+
+if __name__ == "__main__":
+    remote_gc()
@@ -0,0 +1,268 @@
+#
+#  storage.py
+#
+#  Where Walden keeps its copies of data files. By default that is our bucket in DigitalOcean
+#  Spaces, but setting WALDEN_STORAGE_DIR stores them in a local directory instead, e.g. to
+#  run ingests offline or to benchmark transfers reproducibly on a single machine.
+#
+
+import os
+import shutil
+from abc import ABC, abstractmethod
+from os import path
+from typing import IO, List, Optional
+from urllib.parse import unquote, urlparse
+
+from . import files, owid_cache
+from .ui import log
+
+
+class Storage(ABC):
+    "Interface of a place where we store data files, addressed by their path relative to its root."
+
+    @abstractmethod
+    def url(self, relative_path: str) -> str:
+        ...
+
+    @abstractmethod
+    def relative_path(self, url: str) -> Optional[str]:
+        "The path of the file at this URL, or None if it is not in this storage."
+
+    @abstractmethod
+    def exists(self, relative_path: str) -> bool:
+        ...
+
+    @abstractmethod
+    def md5(self, relative_path: str) -> Optional[str]:
+        "The checksum of the stored file, or None if it does not exist or we cannot tell."
+
+    @abstractmethod
+    def upload(
+        self,
+        filename: str,
+        relative_path: str,
+        public: bool = False,
+        md5: Optional[str] = None,
+        multipart_chunksize: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+    ) -> str:
+        "Store the local file, returning its URL."
+
+    @abstractmethod
+    def open_upload(self, relative_path: str, public: bool = False, md5: Optional[str] = None):
+        """
+        Return a writable stream to store a file as it is produced; call `complete(md5)` or `abort()`
+        on it. Pass the md5 if it is already known, so that it is stored with the file from the start.
+        """
+
+    @abstractmethod
+    def copy(self, source_path: str, relative_path: str, public: bool = False, md5: Optional[str] = None) -> str:
+        "Copy a stored file to another path without transferring it through this machine, returning its URL."
+
+    @abstractmethod
+    def download(
+        self,
+        url: str,
+        filename: str,
+        expected_md5: Optional[str] = None,
+        quiet: bool = False,
+        public: bool = True,
+        decompress: Optional[str] = None,
+    ) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, relative_paths: List[str], quiet: bool = False) -> None:
+        ...
+
+
+class S3Storage(Storage):
+    "Our bucket in DigitalOcean Spaces, see `owid_cache`."
+
+    def url(self, relative_path: str) -> str:
+        return f"{owid_cache.HTTPS_BASE}/{relative_path}"
+
+    def relative_path(self, url: str) -> Optional[str]:
+        bucket, key = owid_cache.s3_bucket_key(url)
+        return key if bucket == "walden" else None
+
+    def exists(self, relative_path: str) -> bool:
+        return owid_cache.exists(relative_path)
+
+    def md5(self, relative_path: str) -> Optional[str]:
+        return owid_cache.remote_md5("walden", relative_path)
+
+    def upload(
+        self,
+        filename: str,
+        relative_path: str,
+        public: bool = False,
+        md5: Optional[str] = None,
+        multipart_chunksize: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+    ) -> str:
+        return owid_cache.upload(
+            filename,
+            relative_path,
+            public=public,
+            md5=md5,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency,
+        )
+
+    def open_upload(
+        self, relative_path: str, public: bool = False, md5: Optional[str] = None
+    ) -> owid_cache.StreamingUpload:
+        return owid_cache.StreamingUpload(relative_path, public=public, md5=md5)
+
+    def copy(self, source_path: str, relative_path: str, public: bool = False, md5: Optional[str] = None) -> str:
+        return owid_cache.copy(self.url(source_path), relative_path, public=public, md5=md5)
+
+    def download(
+        self,
+        url: str,
+        filename: str,
+        expected_md5: Optional[str] = None,
+        quiet: bool = False,
+        public: bool = True,
+        decompress: Optional[str] = None,
+    ) -> None:
+        if public:
+            files.download(url, filename, expected_md5=expected_md5, quiet=quiet, decompress=decompress)
+        else:
+            owid_cache.download(url, filename, expected_md5=expected_md5, quiet=quiet, decompress=decompress)
+
+    def delete(self, relative_paths: List[str], quiet: bool = False) -> None:
+        owid_cache.delete_many(relative_paths, quiet=quiet)
+
+
+class LocalStorage(Storage):
+    "A directory on this machine, with files addressed by file:// URLs."
+
+    def __init__(self, root: str):
+        self.root = path.abspath(path.expanduser(root))
+
+    def url(self, relative_path: str) -> str:
+        return f"file://{self._path(relative_path)}"
+
+    def relative_path(self, url: str) -> Optional[str]:
+        parsed = urlparse(url)
+        filename = unquote(parsed.path)
+        if parsed.scheme != "file" or not filename.startswith(self.root + os.sep):
+            return None
+        return path.relpath(filename, self.root)
+
+    def exists(self, relative_path: str) -> bool:
+        return path.exists(self._path(relative_path))
+
+    def md5(self, relative_path: str) -> Optional[str]:
+        return files.checksum(self._path(relative_path)) if self.exists(relative_path) else None
+
+    def upload(
+        self,
+        filename: str,
+        relative_path: str,
+        public: bool = False,
+        md5: Optional[str] = None,
+        multipart_chunksize: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+    ) -> str:
+        dest = self._path(relative_path)
+        os.makedirs(path.dirname(dest), exist_ok=True)
+        files.copy_and_checksum(filename, dest)
+        log("UPLOADED", f"{filename} -> {dest}")
+        return self.url(relative_path)
+
+    def open_upload(self, relative_path: str, public: bool = False, md5: Optional[str] = None) -> "LocalUpload":
+        return LocalUpload(self, relative_path, md5=md5)
+
+    def copy(self, source_path: str, relative_path: str, public: bool = False, md5: Optional[str] = None) -> str:
+        return self.upload(self._path(source_path), relative_path)
+
+    def download(
+        self,
+        url: str,
+        filename: str,
+        expected_md5: Optional[str] = None,
+        quiet: bool = False,
+        public: bool = True,
+        decompress: Optional[str] = None,
+    ) -> None:
+        relative_path = self.relative_path(url)
+        if relative_path is None:
+            raise ValueError(f"{url} is not in local storage at {self.root}")
+
+        if decompress:
+            with open(self._path(relative_path), "rb") as istream, open(filename, "wb") as ostream:
+                sink = files.HashingWriter(ostream)
+                with files.decompressing_writer(sink, decompress) as writer:
+                    shutil.copyfileobj(istream, writer)
+                md5 = sink.hexdigest()
+        else:
+            md5 = files.copy_and_checksum(self._path(relative_path), filename)
+
+        if expected_md5 and md5 != expected_md5:
+            os.remove(filename)
+            raise files.ChecksumDoesNotMatch(f"for file copied from {url}")
+
+        if not quiet:
+            log("DOWNLOADED", f"{url} -> {filename}")
+
+    def delete(self, relative_paths: List[str], quiet: bool = False) -> None:
+        for relative_path in relative_paths:
+            if self.exists(relative_path):
+                os.remove(self._path(relative_path))
+                if not quiet:
+                    log("DELETED", self.url(relative_path))
+
+    def _path(self, relative_path: str) -> str:
+        return path.join(self.root, relative_path)
+
+
+class LocalUpload:
+    """
+    Write a file into local storage as it is produced, see `StreamingUpload` for the S3 equivalent.
+    Its md5 is computed on the way and checked against the one given to `complete`, and to the
+    constructor if it was known in advance. The md5 of a transport-compressed file is that of its
+    content before compression, so only the latter check applies to it.
+    """
+
+    def __init__(self, storage: LocalStorage, relative_path: str, md5: Optional[str] = None):
+        self.storage = storage
+        self.relative_path = relative_path
+        self.md5 = md5
+        self._dest = storage._path(relative_path)
+        os.makedirs(path.dirname(self._dest), exist_ok=True)
+        self._f: IO[bytes] = open(self._dest + ".tmp", "wb")
+        self._writer = files.HashingWriter(self._f)
+
+    def write(self, b) -> int:
+        return self._writer.write(b)
+
+    def complete(self, md5: str) -> str:
+        self._f.close()
+        compressed = self._dest.endswith(tuple("." + extension for extension in files.COMPRESSIONS.values()))
+        if (not compressed and self._writer.hexdigest() != md5) or (self.md5 and md5 != self.md5):
+            os.remove(self._dest + ".tmp")
+            raise files.ChecksumDoesNotMatch(f"for stream stored to {self._dest}")
+
+        shutil.move(self._dest + ".tmp", self._dest)
+        log("UPLOADED", f"stream -> {self._dest}")
+        return self.storage.url(self.relative_path)
+
+    def abort(self) -> None:
+        self._f.close()
+        os.remove(self._dest + ".tmp")
+
+
+def get_storage() -> Storage:
+    "The storage configured for this process: a local directory if WALDEN_STORAGE_DIR is set, otherwise S3."
+    root = os.environ.get("WALDEN_STORAGE_DIR")
+    return LocalStorage(root) if root else S3Storage()
+
+
+def for_url(url: str) -> Storage:
+    "The storage able to fetch the given URL, so that datasets stored locally stay readable."
+    if urlparse(url).scheme == "file":
+        return LocalStorage(path.dirname(unquote(urlparse(url).path)))
+    return S3Storage()
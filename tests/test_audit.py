@@ -0,0 +1,143 @@
+#
+#  test_audit.py
+#  walden
+#
+
+import threading
+import time
+
+import pytest
+import requests
+import requests_mock
+from jsonschema import ValidationError
+
+from owid.walden import audit, catalog
+
+
+def test_check_urls_caches_results(tmp_path):
+    cache_file = str(tmp_path / "urls.json")
+
+    with requests_mock.Mocker() as m:
+        m.head("https://test.com/ok.csv", status_code=200)
+        m.head("https://test.com/gone.csv", status_code=404)
+
+        urls = ["https://test.com/ok.csv", "https://test.com/gone.csv"]
+        assert audit.check_urls(urls, cache_file=cache_file) == {urls[0]: 200, urls[1]: 404}
+        assert m.call_count == 2
+
+        # both the valid and the invalid result are reused
+        assert audit.check_urls(urls, cache_file=cache_file) == {urls[0]: 200, urls[1]: 404}
+        assert m.call_count == 2
+
+        # unless we ask for a fresh check
+        audit.check_urls(urls, use_cache=False, cache_file=cache_file)
+        assert m.call_count == 4
+
+
+def test_check_urls_expires_failures_first(tmp_path):
+    cache_file = str(tmp_path / "urls.json")
+    audit._save_json(
+        {
+            "https://test.com/ok.csv": {"status_code": 200, "checked": time.time() - 7200},
+            "https://test.com/gone.csv": {"status_code": None, "checked": time.time() - 7200},
+        },
+        cache_file,
+    )
+
+    with requests_mock.Mocker() as m:
+        m.head("https://test.com/gone.csv", status_code=200)
+        statuses = audit.check_urls(["https://test.com/ok.csv", "https://test.com/gone.csv"], cache_file=cache_file)
+
+    assert statuses == {"https://test.com/ok.csv": 200, "https://test.com/gone.csv": 200}
+    assert m.call_count == 1
+
+
+def test_check_urls_limits_requests_per_host(tmp_path, monkeypatch):
+    in_flight = {"a.com": 0, "b.com": 0}
+    most_in_flight = {"a.com": 0, "b.com": 0}
+    lock = threading.Lock()
+
+    def head(url, timeout):
+        host = url.split("/")[2]
+        with lock:
+            in_flight[host] += 1
+            most_in_flight[host] = max(most_in_flight[host], in_flight[host])
+        time.sleep(0.01)
+        with lock:
+            in_flight[host] -= 1
+        return 200
+
+    monkeypatch.setattr(audit, "_head", head)
+    monkeypatch.setattr(audit, "MAX_REQUESTS_PER_HOST", 2)
+
+    urls = [f"https://{host}/{i}.csv" for host in in_flight for i in range(10)]
+    statuses = audit.check_urls(urls, use_cache=False, cache_file=str(tmp_path / "urls.json"))
+
+    assert set(statuses.values()) == {200}
+    assert most_in_flight == {"a.com": 2, "b.com": 2}
+
+
+def test_check_urls_times_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(audit, "URL_TIMEOUT", 0.05)
+
+    with requests_mock.Mocker() as m:
+        m.head("https://slow.com/a.csv", exc=requests.exceptions.ConnectTimeout)
+        statuses = audit.check_urls(["https://slow.com/a.csv"], use_cache=False, cache_file=str(tmp_path / "urls.json"))
+        assert m.last_request.timeout == 0.05
+
+    assert statuses == {"https://slow.com/a.csv": None}
+
+
+def test_validate_docs_only_validates_changes(tmp_path):
+    cache_file = str(tmp_path / "index.json")
+    schema = catalog.load_schema()
+    docs = list(catalog.iter_docs())[:10]
+
+    assert audit.validate_docs(docs, schema, cache_file=cache_file) == len(docs)
+    assert audit.validate_docs(docs, schema, cache_file=cache_file) == 0
+
+    # a changed document is validated again, and so is everything if the schema changes
+    filename, doc = docs[0]
+    docs[0] = (filename, dict(doc, name="A new name"))
+    assert audit.validate_docs(docs, schema, cache_file=cache_file) == 1
+    assert audit.validate_docs(docs, dict(schema, title="New"), cache_file=cache_file) == len(docs)
+    assert audit.validate_docs(docs, dict(schema, title="New"), incremental=False, cache_file=cache_file) == len(docs)
+
+
+def test_validate_docs_does_not_remember_failures(tmp_path):
+    cache_file = str(tmp_path / "index.json")
+    schema = catalog.load_schema()
+    filename, doc = next(catalog.iter_docs())
+    invalid = dict(doc, md5=42)
+
+    for _ in range(2):
+        with pytest.raises(ValidationError):
+            audit.validate_docs([(filename, invalid)], schema, cache_file=cache_file)
+
+
+def test_check_objects(monkeypatch):
+    base = "https://walden.nyc3.digitaloceanspaces.com"
+    heads = {
+        "ok.csv": {"ContentLength": 10, "ETag": '"abc"', "Metadata": {}},
+        "corrupt.csv": {"ContentLength": 10, "ETag": '"xyz"', "Metadata": {}},
+        "truncated.csv": {"ContentLength": 5, "ETag": '"abc-2"', "Metadata": {"md5": "abc"}},
+        "compressed.csv.zst": {"ContentLength": 3, "ETag": '"zzz"', "Metadata": {}},
+    }
+    monkeypatch.setattr(audit.owid_cache, "head_object", lambda bucket, key: heads.get(key))
+
+    docs = [
+        {"owid_data_url": f"{base}/{key}", "md5": "abc"}
+        for key in ["ok.csv", "corrupt.csv", "truncated.csv", "missing.csv"]
+    ]
+    docs.append({"owid_data_url": f"{base}/compressed.csv.zst", "md5": "abc", "transport_compression": "zstd"})
+    docs.append({"owid_data_url": "https://nyc3.digitaloceanspaces.com/walden/ok.csv", "md5": "xyz"})
+    docs.append({"owid_data_url": "https://elsewhere.com/a.csv", "md5": "abc"})
+
+    problems = audit.check_objects(docs, sizes={"ok.csv": 10, "truncated.csv": 10})
+
+    assert problems == [
+        "md5 mismatch: corrupt.csv (index abc, bucket xyz)",
+        "size mismatch: truncated.csv (manifest 10, bucket 5)",
+        "missing: missing.csv",
+        "md5 mismatch: ok.csv (index xyz, bucket abc)",
+    ]
@@ -0,0 +1,114 @@
+#
+#  test_bundles.py
+#  walden
+#
+
+import gzip
+import shutil
+
+import requests
+import requests_mock
+
+from owid.walden import bundles, catalog, files
+from owid.walden.catalog import Catalog, Dataset
+
+
+def test_bundles_match_index(tmp_path):
+    bundle_dir = str(tmp_path / "bundles")
+    written = bundles.build(catalog.INDEX_DIR, bundle_dir)
+
+    # one bundle per namespace, with the same documents in the same order
+    assert len(written) == len(bundles._namespaces(catalog.INDEX_DIR))
+    assert list(bundles.iter_docs(bundle_dir, catalog.INDEX_DIR)) == list(files.iter_docs(catalog.INDEX_DIR))
+    assert bundles.check(catalog.INDEX_DIR, bundle_dir) == []
+
+    assert [d.md5 for d in Catalog(bundle_dir=bundle_dir)] == [d.md5 for d in Catalog()]
+
+
+def test_bundles_are_kept_in_sync(tmp_path, monkeypatch):
+    index_dir = tmp_path / "index"
+    shutil.copytree(catalog.INDEX_DIR, index_dir)
+    bundle_dir = str(tmp_path / "bundles")
+    monkeypatch.setattr(catalog, "INDEX_DIR", str(index_dir))
+    bundles.build(str(index_dir), bundle_dir)
+
+    dataset = Dataset(
+        namespace="a_new_namespace",
+        short_name="test",
+        name="Test",
+        description="Test",
+        source_name="Test",
+        url="https://test.com",
+        file_extension="csv",
+        version="2022-01-01",
+        md5="abc",
+    )
+
+    # saved outside of bundles, they get out of date
+    dataset.save()
+    assert bundles.check(str(index_dir), bundle_dir) == ["a_new_namespace"]
+
+    # but not once we use them
+    monkeypatch.setattr(catalog, "BUNDLE_DIR", bundle_dir)
+    dataset.save()
+    assert bundles.check(str(index_dir), bundle_dir) == []
+    assert Catalog().find_one(namespace="a_new_namespace").md5 == "abc"
+
+    dataset.delete()
+    shutil.rmtree(index_dir / "a_new_namespace")
+    bundles.build(str(index_dir), bundle_dir)
+    assert bundles.check(str(index_dir), bundle_dir) == []
+    assert not Catalog().find(namespace="a_new_namespace")
+
+
+def test_publish(monkeypatch):
+    uploaded = {}
+
+    def upload(filename, relative_path, public=False, md5=None):
+        with gzip.open(filename, "rt") as istream:
+            uploaded[relative_path] = istream.read()
+        uploaded["md5"] = md5
+        return f"https://walden.nyc3.digitaloceanspaces.com/{relative_path}"
+
+    monkeypatch.setattr(bundles.owid_cache, "upload", upload)
+
+    assert bundles.publish(catalog.INDEX_DIR) == bundles.REMOTE_BUNDLE_URL
+    md5 = uploaded["md5"]
+    lines = uploaded[bundles.REMOTE_BUNDLE_KEY].splitlines()
+    assert len(lines) == len(list(files.iter_docs(catalog.INDEX_DIR)))
+
+    # the same index gives the same file
+    bundles.publish(catalog.INDEX_DIR)
+    assert uploaded["md5"] == md5
+
+
+def test_fetch_remote(tmp_path):
+    cache_file = str(tmp_path / "catalog.ndjson.gz")
+    content = gzip.compress(b'{"path": "a/2020/b.json", "doc": {"md5": "abc"}}\n')
+
+    with requests_mock.Mocker() as m:
+        m.get(bundles.REMOTE_BUNDLE_URL, content=content, headers={"ETag": '"v1"'})
+        assert bundles.fetch_remote(cache_file) == cache_file
+        assert list(files.iter_docs(cache_file)) == [("a/2020/b.json", {"md5": "abc"})]
+
+        # a current copy is only revalidated
+        m.get(bundles.REMOTE_BUNDLE_URL, status_code=304)
+        bundles.fetch_remote(cache_file)
+        assert m.last_request.headers["If-None-Match"] == '"v1"'
+
+        # and used if the bucket cannot be reached
+        m.get(bundles.REMOTE_BUNDLE_URL, exc=requests.exceptions.ConnectionError)
+        bundles.fetch_remote(cache_file)
+
+    assert list(files.iter_docs(cache_file)) == [("a/2020/b.json", {"md5": "abc"})]
+
+
+def test_remote_catalog(tmp_path, monkeypatch):
+    bundle = tmp_path / "catalog.ndjson.gz"
+    with gzip.open(bundle, "wt") as ostream:
+        for namespace in bundles._namespaces(catalog.INDEX_DIR):
+            ostream.write(bundles.render(catalog.INDEX_DIR, namespace))
+
+    monkeypatch.setattr(bundles, "fetch_remote", lambda cache_file: str(bundle))
+
+    assert [d.md5 for d in Catalog(remote=True)] == [d.md5 for d in Catalog()]
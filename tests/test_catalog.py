@@ -7,7 +7,7 @@
 from pathlib import Path
 import datetime as dt
 
-from jsonschema import Draft7Validator, validate, ValidationError
+from jsonschema import Draft7Validator, ValidationError
 import pytest
 
 from owid.walden.catalog import INDEX_DIR, Dataset, Catalog, load_schema, iter_docs
@@ -21,10 +21,10 @@ def test_schema():
 
 def test_catalog_entries():
     "Make sure every catalog entry matches the schema."
-    schema = load_schema()
+    validator = Draft7Validator(load_schema())
     for filename, doc in iter_docs():
         try:
-            validate(doc, schema)
+            validator.validate(doc)
         except ValidationError as e:
             print("Error in file:", Path(filename).relative_to(INDEX_DIR))
             raise
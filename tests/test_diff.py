@@ -0,0 +1,114 @@
+#
+#  test_diff.py
+#  walden
+#
+
+import json
+import shutil
+import subprocess
+
+from click.testing import CliRunner
+
+from owid.walden import bundles, catalog, diff, files
+from owid.walden.catalog import Catalog
+
+
+def test_catalog_diff(tmp_path):
+    old_dir = tmp_path / "old"
+    new_dir = tmp_path / "new"
+    shutil.copytree(catalog.INDEX_DIR, old_dir)
+    shutil.copytree(catalog.INDEX_DIR, new_dir)
+
+    removed, changed = sorted(files.iter_json(str(new_dir)))[:2]
+    removed_doc = files.load_json(removed)
+    changed_doc = files.load_json(changed)
+
+    (new_dir / removed).unlink()
+    with open(changed, "w") as ostream:
+        ostream.write(files.json_dumps(dict(changed_doc, md5="abc"), indent=2))
+    added_doc = dict(changed_doc, short_name="a_new_dataset")
+    with open(new_dir / "a_new_dataset.json", "w") as ostream:
+        ostream.write(files.json_dumps(added_doc, indent=2))
+
+    changes = list(diff.load(str(old_dir)).diff(diff.load(str(new_dir))))
+
+    assert sorted((c["change"], c["short_name"]) for c in changes) == sorted(
+        [("removed", removed_doc["short_name"]), ("changed", changed_doc["short_name"]), ("added", "a_new_dataset")]
+    )
+    changed_entry = next(c for c in changes if c["change"] == "changed")
+    assert changed_entry["md5"] == "abc"
+    assert changed_entry["previous_md5"] == changed_doc["md5"]
+
+
+def test_diff_cli(tmp_path):
+    bundle_dir = tmp_path / "bundles"
+    bundles.build(catalog.INDEX_DIR, str(bundle_dir))
+    shutil.copytree(catalog.INDEX_DIR, tmp_path / "index")
+
+    # the same catalog as an index folder, a bundle folder and a git revision
+    result = CliRunner().invoke(diff.diff, [str(tmp_path / "index"), str(bundle_dir)])
+    assert result.exit_code == 0
+    assert result.output == ""
+
+    (bundle_dir / "dummy.ndjson").unlink()
+    result = CliRunner().invoke(diff.diff, [str(tmp_path / "index"), str(bundle_dir)])
+    changes = [json.loads(line) for line in result.output.splitlines()]
+    assert changes and {c["change"] for c in changes} == {"removed"}
+    assert {c["namespace"] for c in changes} == {"dummy"}
+
+
+def _commit(repo, docs):
+    "Replace the index in the repository with these documents and commit it, returning the revision."
+    index_dir = repo / "index"
+    shutil.rmtree(index_dir, ignore_errors=True)
+    for relative_path, doc in docs.items():
+        (index_dir / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (index_dir / relative_path).write_text(files.json_dumps(doc, indent=2))
+
+    git = ["git", "-C", str(repo), "-c", "user.name=test", "-c", "user.email=test@test.com"]
+    subprocess.run([*git, "add", "-A"], check=True)
+    subprocess.run([*git, "commit", "-q", "-m", "update"], check=True)
+    return subprocess.run([*git, "rev-parse", "HEAD"], check=True, capture_output=True, text=True).stdout.strip()
+
+
+def test_iter_git_docs(tmp_path, monkeypatch):
+    base = next(catalog.iter_docs())[1]
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    subprocess.run(["git", "init", "-q", str(repo)], check=True)
+    monkeypatch.setattr(catalog, "BASE_DIR", str(repo))
+    monkeypatch.setattr(catalog, "INDEX_DIR", str(repo / "index"))
+
+    doc = dict(base, namespace="a", version="2020", short_name="data")
+    moved = dict(base, namespace="a", version="2020", short_name="moved")
+    old_rev = _commit(
+        repo,
+        {
+            "a/2020/data.json": dict(doc, md5="abc"),
+            "a/2020/moved.json": moved,
+            "a/2020/removed.json": dict(doc, short_name="removed"),
+        },
+    )
+    new_rev = _commit(
+        repo,
+        {
+            "a/2020/data.json": dict(doc, md5="def"),
+            "a/2020/moved.json": dict(moved, owid_data_url="https://elsewhere.com/moved.csv"),
+            "a/2021/data.json": dict(doc, version="2021"),
+        },
+    )
+
+    old = Catalog.from_docs(diff.iter_git_docs(old_rev))
+    new = Catalog.from_docs(diff.iter_git_docs(new_rev))
+    assert len(old) == len(new) == 3
+
+    changes = {(c["change"], c["version"], c["short_name"]): c for c in old.diff(new)}
+    assert set(changes) == {
+        ("changed", "2020", "data"),
+        ("changed", "2020", "moved"),
+        ("removed", "2020", "removed"),
+        ("added", "2021", "data"),
+    }
+    assert changes[("changed", "2020", "data")]["previous_md5"] == "abc"
+    assert changes[("changed", "2020", "moved")]["previous_owid_data_url"] == moved.get("owid_data_url")
+    assert changes[("changed", "2020", "moved")]["owid_data_url"] == "https://elsewhere.com/moved.csv"
@@ -3,9 +3,13 @@
 #  walden
 #
 
+import datetime as dt
+import io
+import json
 import tempfile
 import hashlib
 import requests_mock
+from unittest import mock
 import pytest
 
 from owid.walden import files
@@ -72,3 +76,136 @@ def test_known_checksum():
         md5 = files.checksum(tmp.name)
 
     assert md5 == hashlib.md5(s.encode("utf8")).hexdigest()
+
+
+def test_download_resumes(tmp_path):
+    destination = tmp_path / "data.csv"
+    (tmp_path / "data.csv.tmp").write_bytes(encoded[:10])
+    (tmp_path / "data.csv.tmp.etag").write_text('"v1"')
+
+    with requests_mock.Mocker() as mocker:
+        data_url = "https://very/important/data.csv"
+        mocker.get(data_url, content=encoded[10:], status_code=206)
+        md5 = files.download(data_url, str(destination))
+
+        assert mocker.last_request.headers["Range"] == "bytes=10-"
+        assert mocker.last_request.headers["If-Range"] == '"v1"'
+
+    assert md5 == expected_md5
+    assert destination.read_bytes() == encoded
+    assert not (tmp_path / "data.csv.tmp.etag").exists()
+
+
+def test_download_restarts_if_file_changed(tmp_path):
+    destination = tmp_path / "data.csv"
+    (tmp_path / "data.csv.tmp").write_bytes(b"old contents")
+    (tmp_path / "data.csv.tmp.etag").write_text('"v1"')
+
+    with requests_mock.Mocker() as mocker:
+        data_url = "https://very/important/data.csv"
+        # the ETag no longer matches, so the server ignores the range
+        mocker.get(data_url, content=encoded, headers={"ETag": '"v2"'})
+        md5 = files.download(data_url, str(destination))
+
+    assert md5 == expected_md5
+    assert destination.read_bytes() == encoded
+
+
+def test_download_restarts_if_range_not_satisfiable(tmp_path):
+    destination = tmp_path / "data.csv"
+    (tmp_path / "data.csv.tmp").write_bytes(encoded + b"more")
+
+    with requests_mock.Mocker() as mocker:
+        data_url = "https://very/important/data.csv"
+        mocker.get(data_url, [{"status_code": 416}, {"content": encoded}])
+        md5 = files.download(data_url, str(destination), expected_md5=expected_md5)
+
+        assert mocker.call_count == 2
+        assert "Range" not in mocker.last_request.headers
+
+    assert md5 == expected_md5
+    assert destination.read_bytes() == encoded
+
+
+def test_download_does_not_resume_unverifiable(tmp_path):
+    destination = tmp_path / "data.csv"
+    (tmp_path / "data.csv.tmp").write_bytes(encoded[:10])
+
+    with requests_mock.Mocker() as mocker:
+        data_url = "https://very/important/data.csv"
+        mocker.get(data_url, content=encoded)
+        files.download(data_url, str(destination))
+
+        # neither an ETag nor a checksum could tell that the partial file is still valid
+        assert "Range" not in mocker.last_request.headers
+
+    assert destination.read_bytes() == encoded
+
+
+@pytest.mark.parametrize("move", [False, True])
+def test_copy_and_checksum(tmp_path, move):
+    src = tmp_path / "src.csv"
+    dst = tmp_path / "dst.csv"
+    src.write_bytes(encoded)
+
+    md5 = files.copy_and_checksum(str(src), str(dst), move=move)
+
+    assert md5 == expected_md5
+    assert dst.read_bytes() == encoded
+    assert src.exists() != move
+
+
+def test_download_decompresses(tmp_path):
+    compressed = io.BytesIO()
+    with tempfile.NamedTemporaryFile() as src:
+        src.write(encoded)
+        src.flush()
+        files.compress(src.name, compressed)
+
+    filename = str(tmp_path / "test.csv")
+    with requests_mock.Mocker() as m:
+        m.get("https://test.com/test.csv.zst", content=compressed.getvalue())
+        md5 = files.download("https://test.com/test.csv.zst", filename, expected_md5=expected_md5, decompress="zstd")
+
+    assert md5 == expected_md5
+    with open(filename, "rb") as istream:
+        assert istream.read() == encoded
+
+
+def test_json_dumps_with_orjson_matches_json_module(monkeypatch):
+    pytest.importorskip("orjson")
+    monkeypatch.setattr(files, "JSON_BACKEND", "orjson")
+    doc = {
+        "name": "Côte d'Ivoire – 🌍",
+        "control": "tab\there\x7f",
+        "description": "about 1e6 people, or 0.00001% of 10E9",
+        "numbers": [1, -0.0, 2.5, 0.001, 123456789],
+        "nested": {"empty": {}, "list": [], "none": None, "yes": True},
+        "date": dt.date(2022, 1, 1),
+    }
+
+    # orjson handles all of it, without falling back to the json module
+    monkeypatch.setattr(files, "json", mock.Mock(dumps=mock.Mock(side_effect=AssertionError("fell back"))))
+
+    assert files.json_dumps(doc, indent=2, default=str) == json.dumps(doc, indent=2, default=str)
+    assert files.json_dumps(doc, default=str) == json.dumps(doc, default=str, separators=(",", ":"))
+
+
+@pytest.mark.parametrize("backend", ["orjson", "json"])
+@pytest.mark.parametrize(
+    "doc",
+    [
+        {1: "non-string key"},
+        {"big": 2**70},
+        {"small": 1e-05, "large": 1e16},
+    ],
+)
+def test_json_dumps_falls_back_to_json_module(backend, doc, monkeypatch):
+    monkeypatch.setattr(files, "JSON_BACKEND", backend)
+
+    assert files.json_dumps(doc, indent=2) == json.dumps(doc, indent=2)
+    assert files.json_dumps(doc) == json.dumps(doc, separators=(",", ":"))
+
+
+def test_json_loads_accepts_what_json_module_does():
+    assert files.json_loads(b'{"a": NaN, "b": 123456789012345678901234567890}')["b"] == 123456789012345678901234567890
@@ -0,0 +1,70 @@
+#
+#  test_format_json.py
+#  walden
+#
+
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from owid.walden import catalog, format_json
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    index_dir = tmp_path / "index"
+    index_dir.mkdir()
+    schema_file = tmp_path / "schema.json"
+    schema_file.write_text(format_json.reformat("{}"))
+
+    monkeypatch.setattr(catalog, "INDEX_DIR", str(index_dir))
+    monkeypatch.setattr(catalog, "SCHEMA_FILE", str(schema_file))
+    monkeypatch.setattr(format_json, "CACHE_FILE", str(tmp_path / "cache.json"))
+    return index_dir
+
+
+def test_format_json_reformats(index_dir):
+    (index_dir / "a.json").write_text('{"a": 1}')
+
+    result = CliRunner().invoke(format_json.format_json, ["--check"])
+    assert result.exit_code != 0
+
+    result = CliRunner().invoke(format_json.format_json, [])
+    assert result.exit_code == 0
+    assert (index_dir / "a.json").read_text() == json.dumps({"a": 1}, indent=2) + "\n"
+
+
+def test_format_json_skips_known_good_files(index_dir, monkeypatch):
+    (index_dir / "a.json").write_text(format_json.reformat('{"a": 1}'))
+    (index_dir / "b.json").write_text(format_json.reformat('{"b": 1}'))
+    assert CliRunner().invoke(format_json.format_json, ["--check"]).exit_code == 0
+
+    processed = []
+    process = format_json._process
+    monkeypatch.setattr(format_json, "_process", lambda args: processed.append(args[0]) or process(args))
+
+    (index_dir / "b.json").write_text(format_json.reformat('{"b": 2}'))
+    assert CliRunner().invoke(format_json.format_json, ["--check"]).exit_code == 0
+    assert processed == [str(index_dir / "b.json")]
+
+
+def test_process_all_in_parallel(index_dir, monkeypatch):
+    monkeypatch.setattr(format_json, "MIN_FILES_FOR_POOL", 2)
+    for i in range(4):
+        (index_dir / f"{i}.json").write_text('{"a": %d}' % i)
+
+    results = format_json.process_all(sorted(str(f) for f in index_dir.iterdir()), check=False)
+
+    assert [outcome for _, outcome, _ in results] == ["reformatted"] * 4
+    assert all(format_json.read(str(f)).endswith("}\n") for f in index_dir.iterdir())
+
+
+def test_format_json_cache_expires_with_formatter(index_dir, monkeypatch):
+    (index_dir / "a.json").write_text(format_json.reformat('{"a": 1}'))
+    assert CliRunner().invoke(format_json.format_json, ["--check"]).exit_code == 0
+    assert format_json.load_cache()
+
+    # a different formatter must check every file again
+    monkeypatch.setattr(format_json, "formatter_digest", lambda: "a new formatter")
+    assert not format_json.load_cache()
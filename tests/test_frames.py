@@ -0,0 +1,167 @@
+#
+#  test_frames.py
+#
+#  Unit tests for serialising dataframes into the cache.
+#
+
+import os
+
+import pandas as pd
+import pytest
+
+from owid.walden import catalog, files, frames, ingest
+from owid.walden.catalog import Dataset
+
+
+def _dataset(file_extension):
+    return Dataset(
+        namespace="test",
+        short_name="test",
+        name="test",
+        description="test",
+        source_name="test",
+        url="test",
+        file_extension=file_extension,
+        version="2022-01-01",
+    )
+
+
+@pytest.mark.parametrize("file_extension", ["csv", "feather", "parquet"])
+def test_write_and_create(tmp_path, monkeypatch, file_extension):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path))
+    df = pd.DataFrame({"country": ["France", "Spain"], "year": [2000, 2001], "value": [1.5, 2.5]})
+
+    dataset = Dataset.write_and_create(df, _dataset(file_extension))
+
+    assert dataset.md5 == files.checksum(dataset.local_path)
+    assert not (tmp_path / "test" / "2022-01-01" / f"test.{file_extension}.tmp").exists()
+
+
+def test_write_and_create_not_streamable(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path))
+    df = pd.DataFrame({"country": ["France", "Spain"], "value": [1.5, 2.5]})
+
+    dataset = Dataset.write_and_create(df, _dataset("pkl"))
+
+    assert dataset.md5 == files.checksum(dataset.local_path)
+    assert sorted(os.listdir(tmp_path / "test" / "2022-01-01")) == ["test.pkl"]
+
+
+def test_write_and_create_csv_with_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path))
+    df = pd.DataFrame({"country": ["France"], "year": [2000], "value": [1.5]}).set_index(["country", "year"])
+
+    dataset = Dataset.write_and_create(df, _dataset("csv"))
+
+    with open(dataset.local_path) as istream:
+        assert istream.read() == "country,year,value\nFrance,2000,1.5\n"
+
+
+@pytest.mark.parametrize("canonical", [False, True])
+def test_to_stream_feather_keeps_index(tmp_path, canonical):
+    df = pd.DataFrame({"country": ["Spain", "France"], "year": [2000, 2001], "value": [1.5, 2.5]})
+    filename = tmp_path / "test.feather"
+
+    with open(filename, "wb") as ostream:
+        frames.to_stream(df.set_index(["country", "year"]), ostream, "feather", canonical=canonical)
+
+    stored = pd.read_feather(filename)
+    assert list(stored.columns) == ["country", "year", "value"]
+    assert sorted(stored["country"]) == ["France", "Spain"]
+
+
+@pytest.mark.parametrize("file_extension", ["csv", "feather", "parquet"])
+def test_canonical_md5_ignores_row_order(tmp_path, monkeypatch, file_extension):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path))
+    df = pd.DataFrame({"country": ["Spain", "France", "France"], "year": [2000, 2001, 2000], "value": [1, 2, 3]})
+
+    md5 = Dataset.write_and_create(df, _dataset(file_extension), canonical=True).md5
+    shuffled_md5 = Dataset.write_and_create(df.iloc[[2, 0, 1]], _dataset(file_extension), canonical=True).md5
+
+    assert md5 == shuffled_md5
+
+
+def test_canonicalize_keeps_index():
+    df = pd.DataFrame({"country": ["Spain", "France"], "value": [1, 2]}).set_index("country")
+
+    canonical = frames.canonicalize(df)
+
+    assert list(canonical.index) == ["France", "Spain"]
+    assert list(canonical["value"]) == [2, 1]
+
+
+def test_fingerprint():
+    df = pd.DataFrame({"country": ["Spain", "France"], "value": [1, 2]})
+    shuffled = df.iloc[[1, 0]].reset_index(drop=True)
+
+    assert frames.fingerprint(df) == frames.fingerprint(df.copy())
+    assert frames.fingerprint(df) != frames.fingerprint(shuffled)
+    assert frames.fingerprint(df, ordered=False) == frames.fingerprint(shuffled, ordered=False)
+    assert frames.fingerprint(df) != frames.fingerprint(df.astype({"value": float}))
+
+
+def test_add_to_catalog_skips_unchanged_dataframe(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path))
+    df = pd.DataFrame({"country": ["Spain", "France"], "value": [1, 2]})
+
+    previous = _dataset("csv")
+    previous.fingerprint = frames.fingerprint(df)
+    monkeypatch.setattr(ingest.Catalog, "__init__", lambda self: setattr(self, "datasets", [previous]))
+
+    dataset = _dataset("csv")
+    assert ingest.add_to_catalog(dataset, dataframe=df, skip_unchanged=True) is None
+
+    assert not (tmp_path / "test").exists()
+
+
+def test_add_to_catalog_returns_dataset(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(catalog, "INDEX_DIR", str(tmp_path / "index"))
+    monkeypatch.setattr(ingest.Catalog, "__init__", lambda self: setattr(self, "datasets", []))
+    df = pd.DataFrame({"country": ["Spain", "France"], "value": [1, 2]})
+
+    dataset = ingest.add_to_catalog(_dataset("csv"), dataframe=df, skip_unchanged=True)
+
+    assert dataset is not None
+    assert dataset.md5 == files.checksum(dataset.local_path)
+    assert (tmp_path / "index" / "test" / "2022-01-01" / "test.json").exists()
+
+
+def test_pack():
+    df = pd.DataFrame(
+        {
+            "country": ["France", "France", "France", "Spain"],
+            "code": ["a", "b", "c", "d"],
+            "year": ["2000", "2001", None, "2003"],
+            "value": [1.5, 2.5, None, 4.0],
+        }
+    )
+
+    packed = frames.pack(df, quiet=True)
+
+    assert packed.dtypes.astype(str).to_dict() == {
+        "country": "category",
+        "code": "string",
+        "year": "string",
+        "value": "float32",
+    }
+    assert packed.memory_usage(deep=True).sum() < df.memory_usage(deep=True).sum()
+
+
+def test_pack_keeps_values_exactly():
+    df = pd.DataFrame({"v": [123456789.123, 0.1], "t": ["1.1", "1.10"], "g": ["004", "010"]})
+
+    packed = frames.pack(df, quiet=True)
+
+    assert packed["v"].dtype == "float64"
+    assert packed["v"].tolist() == [123456789.123, 0.1]
+    assert packed["t"].astype(object).tolist() == ["1.1", "1.10"]
+    assert packed["g"].astype(object).tolist() == ["004", "010"]
+
+
+def test_pack_downcasts_exact_floats():
+    df = pd.DataFrame({"whole": [1.0, 2.0, None], "half": [0.5, 1.5, None]})
+
+    packed = frames.pack(df, quiet=True)
+
+    assert packed.dtypes.astype(str).to_dict() == {"whole": "UInt8", "half": "float32"}
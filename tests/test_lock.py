@@ -0,0 +1,58 @@
+#
+#  test_lock.py
+#  walden
+#
+
+import pytest
+
+from owid.walden import catalog
+from owid.walden.catalog import Catalog
+
+
+def test_lock_and_resolve(tmp_path, monkeypatch):
+    lock_file = str(tmp_path / "walden.lock")
+    full = Catalog()
+    dataset = full.datasets[0]
+    latest = full.find_latest(namespace=dataset.namespace, short_name=dataset.short_name)
+
+    exact = f"{dataset.namespace}/{dataset.version}/{dataset.short_name}"
+    lock = full.lock([exact, f"{dataset.namespace}/latest/{dataset.short_name}"], filename=lock_file)
+    assert lock["selectors"][exact] == dataset.relative_base
+
+    # resolving from the lockfile does not touch the index
+    monkeypatch.setattr(catalog, "iter_docs", lambda *args: pytest.fail("the index was read"))
+    locked = Catalog.from_lock(lock_file)
+
+    assert locked.find_one(namespace=dataset.namespace, version=dataset.version, short_name=dataset.short_name).md5 == (
+        dataset.md5
+    )
+    pinned = locked.find_latest(namespace=dataset.namespace, short_name=dataset.short_name)
+    assert (pinned.version, pinned.md5, pinned.owid_data_url) == (latest.version, latest.md5, latest.owid_data_url)
+
+    # selectors resolve to what was recorded for them, even "latest" when an older version is pinned too
+    assert locked.resolve(exact).relative_base == dataset.relative_base
+    assert locked.resolve(f"{dataset.namespace}/latest/{dataset.short_name}").relative_base == latest.relative_base
+
+
+def test_from_lock_rejects_selectors_not_in_the_lock(tmp_path):
+    lock_file = str(tmp_path / "walden.lock")
+    dataset = Catalog().datasets[0]
+    exact = f"{dataset.namespace}/{dataset.version}/{dataset.short_name}"
+    Catalog().lock([exact], filename=lock_file)
+
+    assert Catalog.from_lock(lock_file, selectors=[exact]).resolve(exact).md5 == dataset.md5
+
+    # even a selector that would match a pinned dataset must have been locked
+    with pytest.raises(KeyError):
+        Catalog.from_lock(lock_file, selectors=[f"{dataset.namespace}/{dataset.short_name}"])
+
+    with pytest.raises(KeyError):
+        Catalog.from_lock(lock_file).resolve("no/such/dataset")
+
+
+def test_lock_rejects_unknown_selectors(tmp_path):
+    with pytest.raises(ValueError):
+        Catalog().lock(["not_a_selector"], filename=str(tmp_path / "walden.lock"))
+
+    with pytest.raises(KeyError):
+        Catalog().lock(["no/such/dataset"], filename=str(tmp_path / "walden.lock"))
@@ -1,4 +1,11 @@
+import datetime as dt
+import io
 from unittest import mock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from owid.walden import manifest, owid_cache, remote_gc
 from owid.walden.owid_cache import s3_bucket_key, download
 
 
@@ -18,15 +25,372 @@ def test_s3_bucket_key():
     url = "https://walden.s3-website.us-west-2.amazonaws.com/a/test.csv"
     assert s3_bucket_key(url) == ("walden", "a/test.csv")
 
+    # path-style, as used by some older index entries
+    url = "https://nyc3.digitaloceanspaces.com/walden/a/test.csv"
+    assert s3_bucket_key(url) == ("walden", "a/test.csv")
+
+    url = "http://nyc3.digitaloceanspaces.com/walden/a/test.csv"
+    assert s3_bucket_key(url) == ("walden", "a/test.csv")
+
 
 @mock.patch("owid.walden.owid_cache.connect")
 def test_download(connect_mock):
     download(
         "https://test_bucket.nyc3.digitaloceanspaces.com/test_bucket/test.csv",
         "test.csv",
+        presigned=False,
     )
     assert connect_mock.return_value.download_file.call_args_list[0].args == (
         "test_bucket",
         "test_bucket/test.csv",
         "test.csv",
     )
+
+
+@mock.patch("owid.walden.owid_cache.check_for_default_profile")
+@mock.patch("owid.walden.owid_cache.boto3")
+def test_connect_reuses_client(boto3_mock, check_mock):
+    owid_cache._clients.clear()
+    try:
+        client = owid_cache.connect()
+        assert owid_cache.connect() is client
+        assert boto3_mock.Session.call_count == 1
+        assert check_mock.call_count == 1
+
+        config = boto3_mock.Session.return_value.client.call_args.kwargs["config"]
+        assert config.max_pool_connections == owid_cache.MAX_CONCURRENCY
+    finally:
+        owid_cache._clients.clear()
+
+
+def test_transfer_config():
+    config = owid_cache.transfer_config()
+    assert config.multipart_chunksize == owid_cache.MULTIPART_CHUNKSIZE
+    assert config.max_concurrency == owid_cache.MAX_CONCURRENCY
+
+    config = owid_cache.transfer_config(multipart_chunksize=2**23, max_concurrency=4, use_threads=False)
+    assert config.multipart_threshold == 2**23
+    assert config.max_concurrency == 4
+    assert not config.use_threads
+
+
+@mock.patch("owid.walden.owid_cache.connect")
+def test_upload_skips_unchanged(connect_mock):
+    client = connect_mock.return_value
+    client.head_object.return_value = {"ETag": '"abc"', "Metadata": {}}
+
+    url = owid_cache.upload("test.csv", "a/test.csv", md5="abc")
+
+    assert url == f"{owid_cache.HTTPS_BASE}/a/test.csv"
+    client.upload_file.assert_not_called()
+
+
+@mock.patch("owid.walden.owid_cache.manifest")
+@mock.patch("owid.walden.owid_cache.connect")
+def test_upload_changed(connect_mock, manifest_mock, tmp_path):
+    client = connect_mock.return_value
+    client.head_object.return_value = {"ETag": '"abc-2"', "Metadata": {"md5": "old"}}
+    filename = tmp_path / "test.csv"
+    filename.write_text("a,b\n")
+
+    owid_cache.upload(str(filename), "a/test.csv", md5="abc")
+
+    assert client.upload_file.call_args.kwargs["ExtraArgs"] == {"Metadata": {"md5": "abc"}}
+    manifest_mock.record.assert_called_once_with(client, "a/test.csv", size=4, md5="abc")
+
+
+@mock.patch("owid.walden.owid_cache.manifest")
+@mock.patch("owid.walden.owid_cache.connect")
+def test_copy(connect_mock, manifest_mock):
+    client = connect_mock.return_value
+    client.head_object.return_value = {"ETag": '"old"', "Metadata": {}}
+
+    url = owid_cache.copy(f"{owid_cache.HTTPS_BASE}/a/2020/test.csv", "a/2021/test.csv", public=True, md5="abc")
+
+    assert url == f"{owid_cache.HTTPS_BASE}/a/2021/test.csv"
+    args = client.copy.call_args
+    assert args.args[:3] == ({"Bucket": "walden", "Key": "a/2020/test.csv"}, "walden", "a/2021/test.csv")
+    assert args.kwargs["ExtraArgs"]["Metadata"] == {"md5": "abc"}
+    assert args.kwargs["ExtraArgs"]["ACL"] == "public-read"
+
+
+@mock.patch("owid.walden.owid_cache.manifest")
+@mock.patch("owid.walden.owid_cache.connect")
+def test_delete_many_batches(connect_mock, manifest_mock):
+    client = connect_mock.return_value
+    client.delete_objects.return_value = {}
+
+    owid_cache.delete_many([f"a/{i}.csv" for i in range(2500)], quiet=True)
+
+    batches = [c.kwargs["Delete"]["Objects"] for c in client.delete_objects.call_args_list]
+    assert [len(b) for b in batches] == [1000, 1000, 500]
+
+
+LONG_AGO = dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+
+
+def test_find_orphans():
+    objects = [
+        {"Key": "a/2020/test.csv", "Size": 10, "LastModified": LONG_AGO},
+        {"Key": "a/2020/old.csv", "Size": 20, "LastModified": LONG_AGO},
+        {"Key": "backport/x.csv", "Size": 30, "LastModified": LONG_AGO},
+    ]
+
+    assert remote_gc.find_orphans({"a/2020/test.csv"}, objects) == [("a/2020/old.csv", 20)]
+
+
+def test_find_orphans_skips_recent_objects():
+    now = dt.datetime(2022, 6, 1, tzinfo=dt.timezone.utc)
+    objects = [
+        {"Key": "a/2022/new.csv", "Size": 10, "LastModified": now - dt.timedelta(days=2)},
+        {"Key": "a/2020/old.csv", "Size": 20, "LastModified": LONG_AGO},
+    ]
+
+    assert remote_gc.find_orphans(set(), objects, grace_days=30, now=now) == [("a/2020/old.csv", 20)]
+
+
+@pytest.mark.parametrize(
+    "head,status,ok",
+    [("abc\n", "", True), ("def\n", "", False), ("abc\n", " M index/a.json\n", False)],
+)
+def test_check_index_is_current(monkeypatch, head, status, ok):
+    outputs = {("rev-parse", "HEAD"): head, ("rev-parse", "origin/master"): "abc\n", ("status",): status}
+    monkeypatch.setattr(remote_gc, "_git", lambda *args: outputs.get(args[:2], outputs.get(args[:1], "")))
+    monkeypatch.setattr(remote_gc.catalog, "BUNDLE_DIR", None)
+
+    if ok:
+        remote_gc.check_index_is_current()
+    else:
+        with pytest.raises(SystemExit):
+            remote_gc.check_index_is_current()
+
+
+def test_referenced_keys_path_style():
+    datasets = [
+        mock.Mock(metadata={"owid_data_url": f"{owid_cache.HTTPS_BASE}/a/2020/test.csv"}),
+        mock.Mock(metadata={"owid_data_url": "https://nyc3.digitaloceanspaces.com/walden/a/2020/old.zip"}),
+        mock.Mock(metadata={"source_data_url": "https://elsewhere.com/a/2020/other.csv"}),
+    ]
+    objects = [
+        {"Key": "a/2020/test.csv", "Size": 10, "LastModified": LONG_AGO},
+        {"Key": "a/2020/old.zip", "Size": 20, "LastModified": LONG_AGO},
+        {"Key": "a/2020/other.csv", "Size": 30, "LastModified": LONG_AGO},
+    ]
+
+    keys = remote_gc.referenced_keys(datasets)
+
+    assert keys == {"a/2020/test.csv", "a/2020/old.zip"}
+    assert remote_gc.find_orphans(keys, objects) == [("a/2020/other.csv", 30)]
+
+    # an object whose key a URL ends with is never deleted, even if it is in another bucket
+    assert remote_gc._is_mentioned("a/2020/other.csv", datasets)
+
+
+class FakeBucket:
+    "Just enough of an S3 client for the manifest, keeping the objects in memory."
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix=""):
+        yield {"Contents": [{"Key": key} for key in sorted(self.objects) if key.startswith(Prefix)]}
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete["Objects"]:
+            self.objects.pop(obj["Key"], None)
+        return {}
+
+
+@pytest.fixture
+def compact_now(monkeypatch):
+    "Let compaction fold and delete journal entries as soon as they are written."
+    monkeypatch.setattr(manifest, "COMPACT_MIN_AGE", dt.timedelta(0))
+    monkeypatch.setattr(manifest, "JOURNAL_RETENTION", dt.timedelta(0))
+
+
+def test_manifest_record_and_remove():
+    client = FakeBucket()
+    manifest.save(client, {"a/old.csv": {"size": 1, "md5": "x", "last_modified": "2020-01-01"}})
+
+    manifest.record_copy(client, "a/old.csv", "a/new.csv", md5="x")
+    manifest.record(client, "a/other.csv", size=2, md5="y")
+    assert manifest.load(client)["a/new.csv"]["size"] == 1
+    assert manifest.load(client)["a/other.csv"]["size"] == 2
+
+    manifest.remove(client, ["a/old.csv"])
+    assert set(manifest.load(client)) == {"a/new.csv", "a/other.csv"}
+
+
+def test_manifest_keeps_concurrent_changes(compact_now):
+    client = FakeBucket()
+
+    # two writers that both started from an empty manifest
+    manifest.record(client, "a/first.csv", size=1, md5="x")
+    manifest.record(client, "a/second.csv", size=2, md5="y")
+    assert set(manifest.load(client)) == {"a/first.csv", "a/second.csv"}
+
+    # compacting folds the journal into the manifest, which then loads with a single GET
+    manifest.compact(client)
+    assert list(client.objects) == [manifest.MANIFEST_KEY]
+    assert set(manifest.load(client)) == {"a/first.csv", "a/second.csv"}
+
+
+def test_manifest_auto_compacts(monkeypatch, compact_now):
+    monkeypatch.setattr(manifest, "COMPACT_AFTER", 1)
+    client = FakeBucket()
+
+    manifest.record(client, "a/first.csv", size=1, md5="x")
+    assert set(manifest.load(client)) == {"a/first.csv"}
+    assert len(client.objects) == 1
+
+    manifest.record(client, "a/second.csv", size=2, md5="y")
+    assert set(manifest.load(client)) == {"a/first.csv", "a/second.csv"}
+    assert list(client.objects) == [manifest.MANIFEST_KEY]
+
+
+def test_manifest_keeps_folded_journal_for_a_while(monkeypatch):
+    monkeypatch.setattr(manifest, "COMPACT_MIN_AGE", dt.timedelta(0))
+    client = FakeBucket()
+
+    manifest.record(client, "a/first.csv", size=1, md5="x")
+    manifest.compact(client)
+    manifest.remove(client, ["a/first.csv"])
+
+    # the folded entry is kept in case a slower compaction overwrites the manifest, but never replayed
+    assert len(client.objects) == 3
+    assert manifest.load(client) == {}
+
+
+def test_manifest_compact_raises_on_failed_delete(compact_now):
+    client = FakeBucket()
+    client.delete_objects = mock.Mock(return_value={"Errors": [{"Key": "x", "Code": "AccessDenied"}]})
+
+    manifest.record(client, "a/first.csv", size=1, md5="x")
+    with pytest.raises(manifest.JournalError):
+        manifest.compact(client)
+
+
+def test_manifest_rebuild():
+    modified = dt.datetime(2022, 1, 1, tzinfo=dt.timezone.utc)
+    client = mock.Mock()
+    client.get_paginator.return_value.paginate.side_effect = lambda Bucket, Prefix="": [
+        {
+            "Contents": [
+                {"Key": key, "Size": 10, "ETag": etag, "LastModified": modified}
+                for key, etag in [
+                    ("a/plain.csv", '"abc"'),
+                    ("a/multipart.csv", '"abc-2"'),
+                    ("a/compressed.csv.zst", '"zzz"'),
+                    ("a/stamped.csv.zst", '"zzz"'),
+                    (manifest.MANIFEST_KEY, '"xxx"'),
+                    (f"{manifest.JOURNAL_PREFIX}1.json", '"xxx"'),
+                ]
+                if key.startswith(Prefix)
+            ]
+        }
+    ]
+    client.delete_objects.return_value = {}
+    client.head_object.side_effect = lambda Bucket, Key: {
+        "Metadata": {"md5": "def"} if Key in ("a/multipart.csv", "a/stamped.csv.zst") else {}
+    }
+
+    rebuilt = manifest.rebuild(client)
+
+    # the ETag of a compressed object is not the md5 of its content
+    assert {key: entry["md5"] for key, entry in rebuilt.items()} == {
+        "a/plain.csv": "abc",
+        "a/multipart.csv": "def",
+        "a/compressed.csv.zst": None,
+        "a/stamped.csv.zst": "def",
+    }
+
+    # the journal it covers is deleted
+    assert client.delete_objects.call_args.kwargs["Delete"]["Objects"] == [{"Key": f"{manifest.JOURNAL_PREFIX}1.json"}]
+
+
+def test_manifest_check():
+    problems = manifest.check({"a/test.csv": {"md5": "def"}}, [("a/test.csv", "abc"), ("a/missing.csv", "abc")])
+
+    assert problems == [
+        "md5 mismatch: a/test.csv (index abc, bucket def)",
+        "missing: a/missing.csv",
+    ]
+
+
+@mock.patch("owid.walden.owid_cache.MIN_PART_SIZE", 1)
+@mock.patch("owid.walden.owid_cache.manifest")
+@mock.patch("owid.walden.owid_cache.connect")
+def test_streaming_upload(connect_mock, manifest_mock):
+    client = connect_mock.return_value
+    client.create_multipart_upload.return_value = {"UploadId": "123"}
+    client.upload_part.side_effect = lambda **kwargs: {"ETag": f"etag{kwargs['PartNumber']}"}
+
+    uploader = owid_cache.StreamingUpload("a/test.csv", part_size=10, md5="abc")
+    for _ in range(5):
+        uploader.write(b"0123456")
+    url = uploader.complete("abc")
+
+    assert url == f"{owid_cache.HTTPS_BASE}/a/test.csv"
+    bodies = [c.kwargs["Body"] for c in sorted(client.upload_part.call_args_list, key=lambda c: c.kwargs["PartNumber"])]
+    assert b"".join(bodies) == b"0123456" * 5
+    assert client.complete_multipart_upload.call_args.kwargs["MultipartUpload"]["Parts"] == [
+        {"ETag": "etag1", "PartNumber": 1},
+        {"ETag": "etag2", "PartNumber": 2},
+        {"ETag": "etag3", "PartNumber": 3},
+    ]
+    # the md5 is stored when the upload is created, without copying the object afterwards
+    assert client.create_multipart_upload.call_args.kwargs["Metadata"] == {"md5": "abc"}
+    client.copy.assert_not_called()
+
+
+@mock.patch("owid.walden.owid_cache.MIN_PART_SIZE", 1)
+@mock.patch("owid.walden.owid_cache.manifest")
+@mock.patch("owid.walden.owid_cache.connect")
+def test_streaming_upload_aborts_on_any_error(connect_mock, manifest_mock):
+    client = connect_mock.return_value
+    client.create_multipart_upload.return_value = {"UploadId": "123"}
+    client.upload_part.side_effect = KeyboardInterrupt
+
+    uploader = owid_cache.StreamingUpload("a/test.csv", part_size=10)
+    uploader.write(b"0123456789")
+    with pytest.raises(KeyboardInterrupt):
+        uploader.complete("abc")
+
+    client.abort_multipart_upload.assert_called_once_with(Bucket="walden", Key="a/test.csv", UploadId="123")
+    client.complete_multipart_upload.assert_not_called()
+    manifest_mock.record.assert_not_called()
+
+
+@mock.patch("owid.walden.owid_cache.connect")
+def test_streaming_upload_rejects_small_parts(connect_mock):
+    with pytest.raises(ValueError, match="part_size"):
+        owid_cache.StreamingUpload("a/test.csv", part_size=2**20)
+
+    connect_mock.assert_not_called()
+
+
+@mock.patch("owid.walden.owid_cache.files.download")
+@mock.patch("owid.walden.owid_cache.connect")
+def test_download_presigned(connect_mock, download_mock):
+    connect_mock.return_value.generate_presigned_url.return_value = "https://signed/test.csv"
+
+    download("https://walden.nyc3.digitaloceanspaces.com/a/test.csv", "test.csv", expected_md5="abc")
+
+    assert connect_mock.return_value.generate_presigned_url.call_args.kwargs["Params"] == {
+        "Bucket": "walden",
+        "Key": "a/test.csv",
+    }
+    download_mock.assert_called_once_with(
+        "https://signed/test.csv", "test.csv", expected_md5="abc", quiet=True, decompress=None
+    )
@@ -0,0 +1,76 @@
+#
+#  test_profiling.py
+#
+#  Unit tests for profiles of tabular snapshots.
+#
+
+import pandas as pd
+
+from owid.walden import catalog, profiling
+from owid.walden.catalog import Dataset
+
+
+def _frame():
+    return pd.DataFrame(
+        {
+            "country": ["France", "Spain", "France", None],
+            "year": [2000, 2001, 2020, 2010],
+            "value": [1.0, None, 3.0, 4.0],
+        }
+    )
+
+
+def test_profile_frame():
+    profile = profiling.profile_frame(_frame(), md5="abc")
+
+    assert profile["md5"] == "abc"
+    assert profile["n_rows"] == 4
+    assert profile["n_columns"] == 3
+    assert profile["columns"][2] == {"name": "value", "dtype": "float64", "n_null": 1}
+    assert (profile["year_min"], profile["year_max"]) == (2000, 2020)
+    assert profile["countries"] == ["France", "Spain"]
+    assert profile["n_countries"] == 2
+
+
+def test_profile_frame_with_index():
+    profile = profiling.profile_frame(_frame().set_index(["country", "year"]))
+
+    assert [c["name"] for c in profile["columns"]] == ["country", "year", "value"]
+    assert profile["year_max"] == 2020
+
+
+def test_dataset_profile_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path))
+    dataset = Dataset(
+        namespace="test",
+        short_name="test",
+        name="test",
+        description="test",
+        source_name="test",
+        url="test",
+        file_extension="csv",
+        version="2022-01-01",
+        md5="abc",
+    )
+
+    dataset.add_profile(_frame())
+
+    assert dataset.load_profile()["n_rows"] == 4
+
+
+def test_profile_file_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "CSV_CHUNK_ROWS", 3)
+    filename = tmp_path / "data.csv"
+    _frame().to_csv(filename, index=False)
+
+    assert profiling.profile_file(str(filename), "csv") == profiling.profile_frame(_frame())
+
+
+def test_profile_file_latin1(tmp_path):
+    filename = tmp_path / "data.csv"
+    filename.write_bytes("country,year\nCôte d'Ivoire,2000\n".encode("latin-1"))
+
+    profile = profiling.profile_file(str(filename), "csv")
+
+    assert profile["n_rows"] == 1
+    assert profile["year_min"] == 2000
@@ -0,0 +1,207 @@
+#
+#  test_storage.py
+#
+#  Unit tests for storage backends, using the local directory backend end-to-end.
+#
+
+import hashlib
+import os
+import sys
+
+import pandas as pd
+import pytest
+import requests_mock
+
+from owid.walden import catalog, files, storage
+from owid.walden.catalog import Dataset
+
+
+def _dataset():
+    return Dataset(
+        namespace="test",
+        short_name="test",
+        name="test",
+        description="test",
+        source_name="test",
+        url="test",
+        file_extension="csv",
+        version="2022-01-01",
+    )
+
+
+def test_get_storage(tmp_path, monkeypatch):
+    monkeypatch.delenv("WALDEN_STORAGE_DIR", raising=False)
+    assert isinstance(storage.get_storage(), storage.S3Storage)
+
+    monkeypatch.setenv("WALDEN_STORAGE_DIR", str(tmp_path))
+    assert isinstance(storage.get_storage(), storage.LocalStorage)
+
+
+def test_local_storage_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("WALDEN_STORAGE_DIR", str(tmp_path / "remote"))
+    df = pd.DataFrame({"country": ["France", "Spain"], "year": [2000, 2001]})
+
+    dataset = Dataset.write_and_create(df, _dataset())
+    dataset.upload(public=True)
+
+    remote_file = tmp_path / "remote" / "test" / "2022-01-01" / "test.csv"
+    assert dataset.owid_data_url == f"file://{remote_file}"
+    assert remote_file.exists()
+    assert dataset.owid_profile_url
+
+    # fetch it back from the remote copy
+    os.remove(dataset.local_path)
+    assert dataset.ensure_downloaded() == dataset.local_path
+    assert dataset.load_profile()["n_rows"] == 2
+
+    dataset.delete_from_remote()
+    assert not remote_file.exists()
+
+
+def test_upload_survives_failed_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("WALDEN_STORAGE_DIR", str(tmp_path / "remote"))
+    monkeypatch.setattr(catalog.profiling, "profile_file", lambda *args, **kwargs: 1 / 0)
+    df = pd.DataFrame({"country": ["France", "Spain"], "year": [2000, 2001]})
+
+    dataset = Dataset.write_and_create(df, _dataset())
+
+    assert dataset.upload(public=True)
+    assert dataset.owid_data_url
+    assert not dataset.owid_profile_url
+
+
+def test_local_storage_relative_path(tmp_path):
+    local = storage.LocalStorage(str(tmp_path))
+
+    assert local.relative_path(local.url("a/test.csv")) == "a/test.csv"
+    assert local.relative_path("https://walden.nyc3.digitaloceanspaces.com/a/test.csv") is None
+
+
+def test_s3_storage_relative_path():
+    s3 = storage.S3Storage()
+    assert s3.relative_path("https://walden.nyc3.digitaloceanspaces.com/a/test.csv") == "a/test.csv"
+    assert s3.relative_path("https://nyc3.digitaloceanspaces.com/walden/a/test.csv") == "a/test.csv"
+    assert s3.relative_path("https://nyc3.digitaloceanspaces.com/other/a/test.csv") is None
+
+
+def test_local_storage_compressed_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("WALDEN_STORAGE_DIR", str(tmp_path / "remote"))
+    df = pd.DataFrame({"country": ["France", "Spain"] * 100, "year": range(200)})
+
+    dataset = Dataset.write_and_create(df, _dataset())
+    md5 = dataset.md5
+    dataset.upload(public=True, profile=False, compress=True)
+
+    remote_file = tmp_path / "remote" / "test" / "2022-01-01" / "test.csv.zst"
+    assert dataset.transport_compression == "zstd"
+    assert dataset.owid_data_url == f"file://{remote_file}"
+    assert remote_file.stat().st_size < os.path.getsize(dataset.local_path)
+
+    # the local copy is decompressed again and keeps its md5
+    os.remove(dataset.local_path)
+    dataset.ensure_downloaded()
+    assert files.checksum(dataset.local_path) == md5
+
+    dataset.delete_from_remote()
+    assert not remote_file.exists()
+
+
+def test_upload_copies_stored_content(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(catalog, "_stored_copies", {})
+    monkeypatch.setenv("WALDEN_STORAGE_DIR", str(tmp_path / "remote"))
+    copies = []
+    monkeypatch.setattr(storage.LocalStorage, "copy", lambda self, *args, **kwargs: copies.append(args) or "file://x")
+    df = pd.DataFrame({"country": ["France", "Spain"], "year": [2000, 2001]})
+
+    first = Dataset.write_and_create(df, _dataset())
+    first.upload(profile=False)
+
+    second = _dataset()
+    second.version = "2022-02-01"
+    second = Dataset.write_and_create(df, second)
+    second.upload(profile=False)
+
+    # the same content uploaded earlier in this process is copied, without reading the catalog again
+    assert copies == [("test/2022-01-01/test.csv", "test/2022-02-01/test.csv")]
+
+
+def test_upload_copies_stored_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(catalog, "_stored_copies", {})
+    monkeypatch.setenv("WALDEN_STORAGE_DIR", str(tmp_path / "remote"))
+    df = pd.DataFrame({"country": ["France", "Spain"], "year": [2000, 2001]})
+
+    first = Dataset.write_and_create(df, _dataset())
+    first.upload()
+
+    second = _dataset()
+    second.version = "2022-02-01"
+    second = Dataset.write_and_create(df, second)
+    monkeypatch.setattr(catalog.profiling, "profile_file", lambda *args, **kwargs: pytest.fail("profiled"))
+    second.upload()
+
+    # the profile of the same content is copied too, without reading the data again
+    assert second.owid_profile_url == f"file://{tmp_path}/remote/test/2022-02-01/test.profile.json"
+    assert second.load_profile()["n_rows"] == 2
+
+
+def test_ensure_downloaded_names_missing_zstandard(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setitem(sys.modules, "zstandard", None)
+    dataset = _dataset()
+    dataset.owid_data_url = f"file://{tmp_path}/test.csv.zst"
+    dataset.transport_compression = "zstd"
+
+    with pytest.raises(ImportError, match="zstandard"):
+        dataset.ensure_downloaded()
+
+
+def test_local_upload_checks_md5(tmp_path):
+    remote = storage.LocalStorage(str(tmp_path))
+    content = b"country,year\nFrance,2000\n"
+    md5 = hashlib.md5(content).hexdigest()
+
+    uploader = remote.open_upload("test/test.csv")
+    uploader.write(content)
+    assert uploader.complete(md5) == remote.url("test/test.csv")
+
+    uploader = remote.open_upload("test/other.csv")
+    uploader.write(content)
+    with pytest.raises(files.ChecksumDoesNotMatch):
+        uploader.complete("0" * 32)
+
+    assert sorted(os.listdir(tmp_path / "test")) == ["test.csv"]
+
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        storage.Storage()  # type: ignore
+
+
+def test_download_and_upload(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(catalog, "_stored_copies", {})
+    monkeypatch.setenv("WALDEN_STORAGE_DIR", str(tmp_path / "remote"))
+    content = b"country,year\nFrance,2000\nSpain,2001\n"
+    dataset = _dataset()
+    dataset.source_data_url = "https://test.com/test.csv"
+
+    with requests_mock.Mocker() as m:
+        m.get(dataset.source_data_url, content=content)
+        dataset.download_and_upload()
+
+    remote_file = tmp_path / "remote" / "test" / "2022-01-01" / "test.csv"
+    assert remote_file.read_bytes() == content
+    assert dataset.md5 == files.checksum(str(remote_file))
+    assert dataset.is_public
+    assert dataset.load_profile()["n_rows"] == 2
+
+    # the same content is only downloaded again, not uploaded
+    monkeypatch.setattr(storage.LocalStorage, "open_upload", lambda *args, **kwargs: pytest.fail("uploaded"))
+    with requests_mock.Mocker() as m:
+        m.get(dataset.source_data_url, content=content)
+        dataset.download_and_upload()